@@ -10,11 +10,43 @@ Cell Processor Module
 """
 
 from datetime import datetime
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Tuple
 from openpyxl.utils import get_column_letter
 import openpyxl.cell.cell
 from logger import Logger
 
+# 値の型 → セルのデータ型（セルごとのisinstanceの連鎖を型による辞書引き1回に置き換える）
+_CELL_VALUE_TYPES = {
+    type(None): "empty",
+    int: "numeric",
+    float: "numeric",
+    bool: "numeric",
+    str: "text",
+    datetime: "date"
+}
+
+
+def cell_value_type(value: Any) -> str:
+    """
+    セルの値からデータ型（empty / numeric / date / text）を判定
+
+    Args:
+        value: セルの値
+
+    Returns:
+        str: セルのデータ型を示す文字列
+    """
+    cell_type = _CELL_VALUE_TYPES.get(type(value))
+    if cell_type is not None:
+        return cell_type
+    # 表にない型（数値・日時のサブクラスなど）はisinstanceで判定する
+    if isinstance(value, (int, float)):
+        return "numeric"
+    if isinstance(value, datetime):
+        return "date"
+    return "text"
+
+
 class CellProcessor:
     def __init__(self, logger: Logger):
         """
@@ -35,13 +67,7 @@ class CellProcessor:
         Returns:
             str: セルのデータ型を示す文字列
         """
-        if cell.value is None:
-            return "empty"
-        if isinstance(cell.value, (int, float)):
-            return "numeric"
-        if isinstance(cell.value, datetime):
-            return "date"
-        return "text"
+        return cell_value_type(cell.value)
 
     def extract_region_cells(self, sheet, start_row: int, start_col: int, max_row: int, max_col: int) -> List[List[Dict[str, Any]]]:
         """
@@ -60,47 +86,111 @@ class CellProcessor:
         cells_data = []
         actual_max_row = max_row
         actual_max_col = max_col
+        # 結合セルはシートごとの索引から領域にかかる範囲だけを取り出し、セルごとには辞書で引く
+        merged_lookup = merged_cell_index(sheet).lookup(start_row, start_col, actual_max_row, actual_max_col)
 
-        for row in range(start_row, actual_max_row + 1):
-            row_data = []
-            for col in range(start_col, actual_max_col + 1):
-                cell = sheet.cell(row=row, column=col)
-                cell_type = self.analyze_cell_type(cell)
-
-                if isinstance(cell, openpyxl.cell.cell.MergedCell):
-                    for merged_range in sheet.merged_cells.ranges:
-                        if merged_range.min_row <= row <= merged_range.max_row and \
-                           merged_range.min_col <= col <= merged_range.max_col:
-                            master_cell = sheet.cell(row=merged_range.min_row, column=merged_range.min_col)
-                            cell_info = {
-                                "row": row,
-                                "col": col,
-                                "value": str(master_cell.value) if master_cell.value is not None else "",
-                                "type": cell_type,
-                                "isMerged": True,
-                                "mergedRange": str(merged_range)
-                            }
-                            break
-                    else:
-                        cell_info = {
-                            "row": row,
-                            "col": col,
-                            "value": "",
-                            "type": cell_type,
-                            "isMerged": True
-                        }
-                else:
-                    cell_info = {
-                        "row": row,
-                        "col": col,
-                        "value": str(cell.value) if cell.value is not None else "",
-                        "type": cell_type
-                    }
-
-                row_data.append(cell_info)
-            cells_data.append(row_data)
+        for row_cells in sheet.iter_rows(min_row=start_row, max_row=actual_max_row,
+                                         min_col=start_col, max_col=actual_max_col):
+            cells_data.append([
+                build_cell_info(cell, self.analyze_cell_type(cell), merged_lookup) for cell in row_cells
+            ])
 
         if max_row > actual_max_row or max_col > actual_max_col:
             self.logger.info(f"Note: Region was truncated from {max_row}x{max_col} to {actual_max_row}x{actual_max_col}")
 
         return cells_data
+
+
+class MergedCellIndex:
+    """
+    シート内の結合セルの範囲を行ごとに索引化したもの
+
+    領域やセルごとに sheet.merged_cells.ranges 全体を走査せず、対象の行にかかる範囲だけを調べる。
+    結果の順序（範囲が重なる場合の優先順位）は sheet.merged_cells.ranges の順序に従う。
+    """
+
+    def __init__(self, sheet):
+        """
+        Args:
+            sheet: 対象のワークシート
+        """
+        self.sheet = sheet
+        # read_onlyで開いたシートは結合セルの情報を読み込まないため、空の索引とする
+        merged_cells = getattr(sheet, "merged_cells", None)
+        self._ranges = list(merged_cells.ranges) if merged_cells is not None else []
+        self._rows: Dict[int, List[int]] = {}  # 行 → その行にかかる範囲の位置
+        for position, merged_range in enumerate(self._ranges):
+            for row in range(merged_range.min_row, merged_range.max_row + 1):
+                self._rows.setdefault(row, []).append(position)
+
+    def _overlapping(self, start_row: int, start_col: int, max_row: int, max_col: int) -> List[int]:
+        """指定された範囲にかかる結合範囲の位置を、元の順序で返す"""
+        positions = set()
+        for row in range(start_row, max_row + 1):
+            positions.update(self._rows.get(row, ()))
+        return sorted(position for position in positions
+                      if self._ranges[position].max_col >= start_col and self._ranges[position].min_col <= max_col)
+
+    def ranges_within(self, start_row: int, start_col: int, max_row: int, max_col: int) -> List[Any]:
+        """指定された範囲に完全に含まれる結合範囲を返す"""
+        ranges = (self._ranges[position] for position in self._overlapping(start_row, start_col, max_row, max_col))
+        return [merged_range for merged_range in ranges
+                if (merged_range.min_row >= start_row and merged_range.max_row <= max_row and
+                    merged_range.min_col >= start_col and merged_range.max_col <= max_col)]
+
+    def lookup(self, start_row: int, start_col: int, max_row: int, max_col: int) -> Dict[Tuple[int, int], Tuple[str, Any]]:
+        """
+        指定された範囲にかかる結合セルについて、各セルの座標 → (結合範囲, 左上セルの値) の辞書を作る
+
+        Returns:
+            Dict[Tuple[int, int], Tuple[str, Any]]: (行, 列) → (結合範囲の文字列, 左上セルの値)
+        """
+        merged_lookup = {}
+        for position in self._overlapping(start_row, start_col, max_row, max_col):
+            merged_range = self._ranges[position]
+            entry = (str(merged_range),
+                     self.sheet.cell(row=merged_range.min_row, column=merged_range.min_col).value)
+            for row in range(max(merged_range.min_row, start_row), min(merged_range.max_row, max_row) + 1):
+                for col in range(max(merged_range.min_col, start_col), min(merged_range.max_col, max_col) + 1):
+                    merged_lookup.setdefault((row, col), entry)  # 重なる場合は先に定義された範囲を使う
+        return merged_lookup
+
+
+def merged_cell_index(sheet) -> MergedCellIndex:
+    """シートの結合セルの索引を返す（シートごとに初回のみ作成する）"""
+    # 索引はシートの属性として保持し、シートと一緒に破棄されるようにする
+    # （結合範囲はシートを参照するため、シートをキーとする弱参照の辞書では値からキーが参照され続け、
+    #   処理したブックがプロセス内に残り続ける）
+    index = getattr(sheet, "_merged_cell_index", None)
+    if index is None:
+        index = sheet._merged_cell_index = MergedCellIndex(sheet)
+    return index
+
+
+def build_cell_info(cell, cell_type: str, merged_lookup: Dict[Tuple[int, int], Tuple[str, Any]]) -> Dict[str, Any]:
+    """セル1つ分の情報を組み立てる（結合セルは左上セルの値と結合範囲を持つ）"""
+    if isinstance(cell, openpyxl.cell.cell.MergedCell):
+        merged = merged_lookup.get((cell.row, cell.column))
+        if merged is None:
+            return {
+                "row": cell.row,
+                "col": cell.column,
+                "value": "",
+                "type": cell_type,
+                "isMerged": True
+            }
+        merged_range, master_value = merged
+        return {
+            "row": cell.row,
+            "col": cell.column,
+            "value": str(master_value) if master_value is not None else "",
+            "type": cell_type,
+            "isMerged": True,
+            "mergedRange": merged_range
+        }
+    return {
+        "row": cell.row,
+        "col": cell.column,
+        "value": str(cell.value) if cell.value is not None else "",
+        "type": cell_type
+    }
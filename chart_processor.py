@@ -19,6 +19,9 @@ import xml.etree.ElementTree as ET
 from openpyxl.chart import BarChart, LineChart, PieChart, ScatterChart, Reference
 from openpyxl.utils.cell import coordinate_from_string, column_index_from_string
 
+# LLMのプロンプトに埋め込むJSONの書式（区切りの空白なし・非ASCII文字をエスケープしない）
+_COMPACT_JSON = {"ensure_ascii": False, "separators": (",", ":")}
+
 
 class ChartProcessor:
 
@@ -321,7 +324,9 @@ class ChartProcessor:
                         chart_info["series"].append(series_data)
 
                     # Set chart data
-                    chart_info["chart_data_json"] = json.dumps(chart_data)
+                    # 要約のプロンプトにそのまま埋め込むため、空白を省き日本語もエスケープせずに出力する
+                    chart_info["chart_data_json"] = json.dumps(
+                        chart_data, **_COMPACT_JSON)
                     self.logger.info("Complete chart info")
                     # self.logger.info(f"Chart data: {json.dumps(chart_data, indent=2)}")
 
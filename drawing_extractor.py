@@ -1,5 +1,5 @@
 import os
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Tuple
 import xml.etree.ElementTree as ET
 import base64
 from logger import Logger
@@ -12,9 +12,18 @@ from collections import defaultdict, deque
 
 class DrawingExtractor:
 
-    def __init__(self, logger: Logger):
+    def __init__(self,
+                 logger: Logger,
+                 openai_helper: OpenAIHelper,
+                 defer_image_analysis: bool = False):
         self.logger = logger
-        self.openai_helper = OpenAIHelper()
+        self.openai_helper = openai_helper
+        # Trueの場合、画像はその場で分析せず image_base64 に画像データを残し、呼び出し側でまとめて分析する
+        self.defer_image_analysis = defer_image_analysis
+        # VMLファイルの (パス, CRC) の組 → フォームコントロール情報
+        # ブック内の全VMLを対象とするため、描画を持つシートごとに解析し直さない
+        self._vml_controls_cache: Dict[Tuple[Tuple[str, int], ...],
+                                       List[Dict[str, Any]]] = {}
         self.ns = {
             'a': 'http://schemas.openxmlformats.org/drawingml/2006/main',
             'xdr':
@@ -201,11 +210,16 @@ class DrawingExtractor:
         return f"{from_col}{coords['from']['row'] + 1}:{to_col}{coords['to']['row'] + 1}"
 
     def _get_vml_controls(self, excel_zip):
-        vml_controls = []
         vml_files = [
             f for f in excel_zip.namelist()
             if f.startswith('xl/drawings/') and f.endswith('.vml')
         ]
+        cache_key = tuple(
+            (vml_file, excel_zip.getinfo(vml_file).CRC) for vml_file in vml_files)
+        if cache_key in self._vml_controls_cache:
+            return self._vml_controls_cache[cache_key]
+
+        vml_controls = []
 
         for vml_file in vml_files:
             try:
@@ -218,6 +232,7 @@ class DrawingExtractor:
                     f"Error processing VML file {vml_file}: {str(e)}")
                 self.logger.exception(e)
 
+        self._vml_controls_cache[cache_key] = vml_controls
         return vml_controls
 
     def _parse_vml_for_controls(self, vml_content):
@@ -436,6 +451,11 @@ class DrawingExtractor:
                                                         image_data).decode(
                                                             'utf-8')
 
+                                                    if self.defer_image_analysis:
+                                                        image_info[
+                                                            "image_base64"] = image_base64
+                                                        return image_info
+
                                                     analysis_result = None
                                                     if hasattr(
                                                             self,
@@ -11,7 +11,7 @@ Excelファイルのメタデータを包括的に抽出・分析するコアモ
 """
 
 import os
-import json
+import asyncio
 import math
 from datetime import datetime
 import zipfile
@@ -22,38 +22,51 @@ from drawing_extractor import DrawingExtractor
 from region_analyzer import RegionAnalyzer
 import openpyxl.cell.cell
 from openpyxl.utils import get_column_letter
-from typing import Dict, Any, List, Optional, Tuple
+from typing import Dict, Any, List, Optional, Set, Tuple
 from openai_helper import OpenAIHelper
 from chart_processor import ChartProcessor
 from cell_processor import CellProcessor
 import traceback
 from pathlib import Path
 import tempfile
-import streamlit as st
 import re
 from openpyxl.chart import BarChart, LineChart, PieChart, ScatterChart, Reference
-import matplotlib.pyplot as plt
 from openpyxl.utils.cell import coordinate_from_string, column_index_from_string
 import base64
 import numpy as np
 
-from vml_processor import VMLProcessor
-
-from region_detector import RegionDetector
+from region_detector import (RegionDetector, scan_cell_regions,
+                             scan_sheets_parallel)
 
 
 class ExcelMetadataExtractor:
 
-    def __init__(self, file_obj):
+    def __init__(self,
+                 file_obj,
+                 openai_helper: Optional[OpenAIHelper] = None,
+                 batch_mode: bool = False,
+                 scan_processes: int = 1):
         self.file_obj = file_obj
+        # Trueの場合、LLMへの問い合わせを段階ごとにBatch APIでまとめて実行する（安価だが低速）
+        self.batch_mode = batch_mode
+        # 2以上の場合、シートごとのセルの走査をこの数までのプロセスで並行に行う
+        # （各プロセスがブックを読み込み直すため、シート数が多く各シートが大きいブック向け）
+        self.scan_processes = scan_processes
         self.workbook = load_workbook(file_obj, data_only=True)
-        self.openai_helper = OpenAIHelper()
+        # 呼び出し側で共有しているヘルパーがあれば再利用する（接続プール・キャッシュを引き継ぐ）
+        # 共有ヘルパーは for_extraction() で抽出ごとのものにして渡す（記録・トークン使用量を抽出ごとに分ける）
+        self.openai_helper = openai_helper or OpenAIHelper()
         self.MAX_CELLS_PER_ANALYSIS = 100
         self.logger = Logger()
-        self.drawing_extractor = DrawingExtractor(self.logger)
+        # 画像の分析はLLMによる他の分析と並行に行うため、描画の抽出時には行わない
+        self.drawing_extractor = DrawingExtractor(self.logger,
+                                                  self.openai_helper,
+                                                  defer_image_analysis=True)
         self.chart_processor = ChartProcessor(self.logger)
         self.cell_processor = CellProcessor(self.logger)
         self.region_analyzer = RegionAnalyzer(self.logger, self.openai_helper)
+        # 領域ごとに作り直さず使い回す（Loggerの初期化でログファイルを開き直さないようにする）
+        self.region_detector = RegionDetector()
 
         # Store excel_zip for later use
         temp_dir = tempfile.mkdtemp()
@@ -93,75 +106,93 @@ class ExcelMetadataExtractor:
         return self.drawing_extractor.extract_drawing_info(
             sheet, excel_zip, drawing_path, self.openai_helper)
 
-    def _get_vml_controls(self, excel_zip):
-        vml_controls = []
-        vml_files = [
-            f for f in excel_zip.namelist()
-            if f.startswith('xl/drawings/') and f.endswith('.vml')
-        ]
+    def detect_regions(self, sheet) -> List[Dict[str, Any]]:
+        return self.detect_regions_for_sheets([sheet])[0]
 
-        for vml_file in vml_files:
-            try:
-                with excel_zip.open(vml_file) as f:
-                    vml_content = f.read().decode('utf-8')
-                    controls = self._parse_vml_for_controls(vml_content)
-                    vml_controls.extend(
-                        controls)  #extend the list instead of overwriting.
-            except Exception as e:
-                self.logger.error(
-                    f"Error processing VML file {vml_file}: {str(e)}")
-                self.logger.exception(e)
-
-        return vml_controls
-
-    def _parse_vml_for_controls(self, vml_content):
-        vml_processor = VMLProcessor(self.logger)
-        return vml_processor.parse_vml_for_controls(vml_content)
-
-    # def extract_drawing_info(self, sheet, excel_zip,
-    #                          drawing_path) -> List[Dict[str, Any]]:
-    #     return self.drawing_extractor.extract_drawing_info(
-    #         sheet, excel_zip, drawing_path, self.openai_helper)
-
-    #     # Process charts through ChartProcessor
-    #     chart = anchor.find('.//c:chart', self.ns)
-    #     if chart is not None:
-    #         chart_info = self.chart_processor._extract_chart_info(
-    #             chart, excel_zip)
-    #         if chart_info:
-    #             chart_info["coordinates"] = coordinates
-    #             chart_info["range"] = range_str
-    #             drawing_list.append(chart_info)
-
-    #     # Process other elements
-    #     for grp in anchor.findall('.//xdr:grpSp', self.ns):
-    #         group_info = self.drawing_extractor._extract_group_info(grp)
-    #         if group_info:
-    #             group_info["coordinates"] = coordinates
-    #             group_info["range"] = range_str
-    #             drawing_list.append(group_info)
-
-    #     for cxn in anchor.findall('.//xdr:cxnSp', self.ns):
-    #         connector_info = self.drawing_extractor._extract_connector_info(
-    #             cxn)
-    #         if connector_info:
-    #             connector_info["coordinates"] = coordinates
-    #             connector_info["range"] = range_str
-    #             drawing_list.append(connector_info)
+    def detect_regions_for_sheets(self,
+                                  sheets) -> List[List[Dict[str, Any]]]:
+        """
+        複数シートの領域を検出し、シートごとの領域リストを返す
 
-    def detect_regions(self, sheet) -> List[Dict[str, Any]]:
+        描画の抽出とセルの走査はシートごとに順に行い、LLMによる分析・サマリー生成は
+        全シート分を並行に行う（同時リクエスト数はOpenAIHelperの上限に従う）。
+        """
         self.logger.method_start("detect_regions")
-        regions = []
+        try:
+            if self.scan_processes > 1 and len(sheets) > 1:
+                collected = self._collect_regions_parallel(sheets)
+            else:
+                collected = [self._collect_regions(sheet) for sheet in sheets]
+
+            async def analyze_all() -> List[List[Dict[str, Any]]]:
+                return await asyncio.gather(*[
+                    self._analyze_regions(sheet, sheet_regions)
+                    for sheet, sheet_regions in zip(sheets, collected)
+                ])
+
+            return self.openai_helper.run_async(analyze_all())
+        finally:
+            self.logger.method_end("detect_regions")
+
+    def _collect_regions(
+        self, sheet
+    ) -> Optional[Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]]:
+        """シートの描画領域と、LLMで分析するセル領域の候補を収集する（失敗時はNone）"""
+        drawings = self._collect_drawing_regions(sheet)
+        if drawings is None:
+            return None
+        drawing_regions, processed_cells = drawings
+        try:
+            candidates = scan_cell_regions(sheet, processed_cells,
+                                           self.region_detector,
+                                           self.cell_processor, self.logger)
+        except Exception as e:
+            self.logger.error(f"Error in detect_regions: {str(e)}")
+            self.logger.exception(e)
+            return None
+        return drawing_regions, candidates
+
+    def _collect_regions_parallel(
+        self, sheets
+    ) -> List[Optional[Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]]]:
+        """
+        _collect_regionsの並列版（描画の抽出はこのプロセスで、セルの走査はワーカープロセスで行う）
+
+        ワーカープロセスを起動できない等で並列の走査に失敗した場合は、このプロセスで順に走査する。
+        """
+        drawings = [self._collect_drawing_regions(sheet) for sheet in sheets]
+        targets = [(sheet, drawing) for sheet, drawing in zip(sheets, drawings)
+                   if drawing is not None]
+        try:
+            self.file_obj.seek(0)
+            scanned = scan_sheets_parallel(
+                self.file_obj.read(), [sheet.title for sheet, _ in targets],
+                [processed for _, (_, processed) in targets],
+                self.scan_processes)
+        except Exception as e:
+            self.logger.error(
+                f"Parallel region scan failed, scanning sequentially: {str(e)}"
+            )
+            scanned = [
+                scan_cell_regions(sheet, processed, self.region_detector,
+                                  self.cell_processor, self.logger)
+                for sheet, (_, processed) in targets
+            ]
+
+        scanned = iter(scanned)
+        return [(drawing[0], next(scanned)) if drawing is not None else None
+                for drawing in drawings]
+
+    def _collect_drawing_regions(
+        self, sheet
+    ) -> Optional[Tuple[List[Dict[str, Any]], Set[Tuple[int, int]]]]:
+        """シートの描画領域と、描画が占めるセルの (行, 列) を収集する（失敗時はNone）"""
         drawing_regions = []
-        cell_regions = []
-        processed_cells = set()
+        processed_cells = set()  # 処理済みセルの (行, 列)
 
         try:
             self.logger.info("Starting region detection...")
             self.logger.info(f"Sheet name: {sheet.title}")
-            self.logger.info(
-                f"Sheet dimensions: {sheet.max_row} rows x {sheet.max_column} columns"
-            )
             with tempfile.TemporaryDirectory() as temp_dir:
                 temp_zip = os.path.join(temp_dir, 'temp.xlsx')
                 with open(temp_zip, 'wb') as f:
@@ -211,6 +242,10 @@ class ExcelMetadataExtractor:
                                 if "gpt4o_analysis" in drawing:
                                     region_info["gpt4o_analysis"] = drawing[
                                         "gpt4o_analysis"]
+                                elif "image_base64" in drawing:
+                                    # 分析は _analyze_images でまとめて行う
+                                    region_info["image_base64"] = drawing[
+                                        "image_base64"]
                                 else:
                                     self.logger.info(
                                         "No gpt-4o analysis found for image")
@@ -240,147 +275,40 @@ class ExcelMetadataExtractor:
                                 to_col = drawing["coordinates"]["to"]["col"]
                                 to_row = drawing["coordinates"]["to"]["row"]
 
-                                for r in range(from_row, to_row + 1):
-                                    for c in range(from_col, to_col + 1):
-                                        processed_cells.add(
-                                            f"{get_column_letter(c+1)}{r+1}")
-
-            # セル領域の処理
-
-            for row in range(1, min(sheet.max_row + 1, 500)):
-                for col in range(1, min(sheet.max_column + 1, 50)):
-                    try:
-                        cell_coord = f"{get_column_letter(col)}{row}"
-                        if cell_coord in processed_cells:
-                            # self.logger.info(f"Skipping processed cell {cell_coord}")
-                            continue
-
-                        cell = sheet.cell(row=row, column=col)
-                        if cell.value is None:
-                            # self.logger.info(f"Skipping empty cell {cell_coord}")
-                            continue
-
-                        # 区切り文字のみのセルはスキップ
-                        if isinstance(cell.value, str) and len(
-                                cell.value.strip()) == 1 and cell.value.strip(
-                                ) in '-_=':
-                            continue
-
-                        max_row, max_col = self.find_region_boundaries(
-                            sheet, row, col)
-                        self.logger.info(
-                            f"max_row:{max_row}, max_col:{get_column_letter(max_col)}"
-                        )
-                        cells_data = self.cell_processor.extract_region_cells(
-                            sheet, row, col, max_row, max_col)
-                        if not cells_data:  # 空のデータの場合はスキップ
-                            continue
-
-                        merged_cells = self.get_merged_cells_info(
-                            sheet, row, col, max_row, max_col)
-
-                        # 処理済みのセルを記録
-                        for r in range(row, max_row + 1):
-                            for c in range(col, max_col + 1):
-                                processed_cells.add(
-                                    f"{get_column_letter(c)}{r}")
-
-                        try:
-                            region_analysis = self.openai_helper.analyze_region_type(
-                                json.dumps({
-                                    "cells": cells_data,
-                                    "mergedCells": merged_cells
-                                }))
-
-                            if isinstance(region_analysis, str):
-                                region_analysis = json.loads(region_analysis)
-
-                            region_type = region_analysis.get(
-                                "regionType", "unknown")
-                            region_metadata = {
-                                "regionType": region_type,
-                                "range":
-                                f"{get_column_letter(col)}{row}:{get_column_letter(max_col)}{max_row}",
-                                "sampleCells": cells_data,
-                                "mergedCells": merged_cells
-                            }
+                                processed_cells.update(
+                                    (r + 1, c + 1)
+                                    for r in range(from_row, to_row + 1)
+                                    for c in range(from_col, to_col + 1))
 
-                            if region_type == "table":
-                                try:
-                                    header_analysis = self.openai_helper.analyze_table_structure(
-                                        json.dumps(cells_data),
-                                        json.dumps(merged_cells))
-
-                                    if isinstance(header_analysis, str):
-                                        header_analysis = json.loads(
-                                            header_analysis)
-
-                                    header_rows = header_analysis.get(
-                                        "headerStructure", {}).get("rows", [])
-                                    header_range = "N/A"
-
-                                    if header_rows:
-                                        min_header_row = min(header_rows)
-                                        max_header_row = max(header_rows)
-                                        header_range = (
-                                            f"{min_header_row}"
-                                            if min_header_row == max_header_row
-                                            else
-                                            f"{min_header_row}-{max_header_row}"
-                                        )
-
-                                    region_metadata["headerStructure"] = {
-                                        "headerType":
-                                        header_analysis.get(
-                                            "headerStructure",
-                                            {}).get("type", "none"),
-                                        "headerRows":
-                                        header_rows,
-                                        "headerRange":
-                                        header_range,
-                                        "mergedCells":
-                                        bool(merged_cells),
-                                        "start_row":
-                                        row
-                                    }
-                                except Exception as e:
-                                    self.logger.error(
-                                        f"Error analyzing table header: {str(e)}"
-                                    )
-                                    continue
-
-                            cell_regions.append(region_metadata)
-
-                        except Exception as e:
-                            self.logger.error(
-                                f"Error analyzing region at {cell_coord}: {str(e)}"
-                            )
-                            continue
-
-                    except Exception as e:
-                        self.logger.error(
-                            f"Error processing cell at row {row}, col {col}: {str(e)}"
-                        )
-                        continue
-
-            # サマリーの生成
-
-            for region in drawing_regions + cell_regions:
-                try:
-                    if "regionType" not in region:
-                        region["regionType"] = region.get("type", "unknown")
-                    region["summary"] = self.openai_helper.summarize_region(
-                        region)
-                except Exception as e:
-                    self.logger.error(
-                        f"Error generating summary for region: {str(e)}")
-                    continue
+        except Exception as e:
+            self.logger.error(f"Error in detect_regions: {str(e)}")
+            self.logger.exception(e)
+            return None
+
+        return drawing_regions, processed_cells
+
+    async def _analyze_regions(
+        self, sheet,
+        collected: Optional[Tuple[List[Dict[str, Any]],
+                                  List[Dict[str, Any]]]]
+    ) -> List[Dict[str, Any]]:
+        """収集した領域の分析・サマリー生成を行い、シートの領域リストを返す"""
+        if collected is None:
+            return []
+        drawing_regions, candidates = collected
+        regions = []
+
+        try:
+            # 描画領域のサマリー生成と、セル領域の種類判定・テーブル構造分析・サマリー生成を並行実行
+            cell_regions = await self._analyze_sheet_regions(
+                drawing_regions, candidates)
 
             regions.extend(drawing_regions)
             regions.extend(cell_regions)
 
             # Log all detected regions
-            self.logger.info(f"Total regions detected: {len(regions)}")
+            self.logger.info(
+                f"Total regions detected in {sheet.title}: {len(regions)}")
             self.logger.info("=== Drawing Regions ===")
             for idx, region in enumerate(drawing_regions):
                 self.logger.info(
@@ -411,7 +339,7 @@ class ExcelMetadataExtractor:
                     }
 
                     metadata[
-                        "summary"] = self.openai_helper.generate_sheet_summary(
+                        "summary"] = await self.openai_helper.generate_sheet_summary_async(
                             sheet_data)
                     regions.append(metadata)
                 except Exception as e:
@@ -422,24 +350,193 @@ class ExcelMetadataExtractor:
         except Exception as e:
             self.logger.error(f"Error in detect_regions: {str(e)}")
             self.logger.exception(e)
-            self.logger.method_end("detect_regions")
             return []
-        finally:
-            self.logger.method_end("detect_regions")
 
-    def find_region_boundaries(self, sheet, start_row: int,
-                               start_col: int) -> Tuple[int, int]:
-        region_detector = RegionDetector()
-        return region_detector.find_region_boundaries(sheet, start_row,
-                                                      start_col)
+    async def _analyze_sheet_regions(
+            self, drawing_regions: List[Dict[str, Any]],
+            candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """シート内の全領域の分析・サマリー生成を並行に行い、セル領域のメタデータを返す"""
+
+        async def analyze_cells() -> List[Dict[str, Any]]:
+            cell_regions = await self._analyze_cell_regions(candidates)
+            await self._summarize_regions(cell_regions)
+            return cell_regions
+
+        async def analyze_drawings() -> None:
+            await self._analyze_images(drawing_regions)
+            await self._summarize_regions(drawing_regions)
+
+        _, cell_regions = await asyncio.gather(analyze_drawings(),
+                                               analyze_cells())
+        return cell_regions
+
+    async def _analyze_images(self, regions: List[Dict[str, Any]]) -> None:
+        """画像領域をまとめて並行に分析し、各領域の gpt4o_analysis に格納する"""
+        images = [
+            region for region in regions if "image_base64" in region
+        ]
+        if self.batch_mode and images:
+            # Batch APIで取得した応答をキャッシュ経由で画像ごとに参照する
+            await self.openai_helper.prefetch_images_async(
+                [region["image_base64"] for region in images])
+
+        async def analyze(region: Dict[str, Any]) -> None:
+            region[
+                "gpt4o_analysis"] = await self.openai_helper.analyze_image_with_gpt4o_async(
+                    region.pop("image_base64"))
+
+        await asyncio.gather(*[analyze(region) for region in images])
+
+    async def _summarize_regions(self, regions: List[Dict[str, Any]]) -> None:
+        """領域のサマリーを並行に生成し、各領域の summary に格納する"""
+        for region in regions:
+            if "regionType" not in region:
+                region["regionType"] = region.get("type", "unknown")
+        if not self.batch_mode:
+            # 複数領域の要約を1つのプロンプトにまとめて生成する
+            summaries = await self.openai_helper.summarize_regions_async(
+                regions)
+            for region, summary in zip(regions, summaries):
+                region["summary"] = summary
+            return
+
+        # Batch APIで取得した応答をキャッシュ経由で領域ごとに参照する
+        await self.openai_helper.prefetch_summaries_async(regions)
+
+        async def summarize(region: Dict[str, Any]) -> None:
+            try:
+                region[
+                    "summary"] = await self.openai_helper.summarize_region_async(
+                        region)
+            except Exception as e:
+                self.logger.error(
+                    f"Error generating summary for region: {str(e)}")
+
+        await asyncio.gather(*[summarize(region) for region in regions])
+
+    async def _analyze_cell_regions(
+            self, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """候補領域の種類判定・テーブル構造分析をまとめて行い、成功した領域のメタデータを返す"""
+        # 判定には先頭の数行と結合セルを含む行しか使わないため、先に切り詰めて渡す
+        sample_rows = [
+            self.openai_helper.select_sample_rows(candidate["cells"],
+                                                  candidate["mergedCells"])
+            for candidate in candidates
+        ]
+        region_data_list = [
+            {
+                "cells": rows,
+                "mergedCells": candidate["mergedCells"]
+            } for candidate, rows in zip(candidates, sample_rows)
+        ]
+        if self.batch_mode:
+            # Batch APIで取得した応答をキャッシュ経由で領域ごとに参照する
+            await self.openai_helper.prefetch_tasks_async(
+                "region_and_structure", [(region_data, )
+                                         for region_data in region_data_list])
+            region_analyses = await asyncio.gather(*[
+                self.openai_helper.analyze_region_and_structure_async(
+                    region_data) for region_data in region_data_list
+            ])
+        else:
+            # 種類判定とテーブルのヘッダー判定は、複数領域を1つのプロンプトにまとめて1回で行う
+            region_analyses = await self.openai_helper.analyze_region_and_structure_batch_async(
+                region_data_list)
+
+        llm_count = sum(1 for region_analysis in region_analyses
+                        if region_analysis.get("used_llm"))
+        self.logger.info(
+            f"Region type analysis: {llm_count} via LLM, "
+            f"{len(region_analyses) - llm_count} classified locally")
+
+        # ヘッダー判定の結果が含まれているテーブルはそのまま使う
+        header_analysis_map = {
+            i: region_analysis
+            for i, region_analysis in enumerate(region_analyses)
+            if region_analysis.get("regionType") == "table"
+            and isinstance(region_analysis.get("headerStructure"), dict)
+        }
+
+        # ローカルで判定したテーブルなど、ヘッダー判定が未実施のものだけ追加で判定する
+        table_indices = [
+            i for i, region_analysis in enumerate(region_analyses)
+            if region_analysis.get("regionType") == "table"
+            and i not in header_analysis_map
+        ]
+        tables = [(sample_rows[i], candidates[i]["mergedCells"])
+                  for i in table_indices]
+        if self.batch_mode:
+            await self.openai_helper.prefetch_tasks_async(
+                "table_structure", tables)
+            header_analyses = await asyncio.gather(*[
+                self.openai_helper.analyze_table_structure_async(*table)
+                for table in tables
+            ])
+        else:
+            header_analyses = await self.openai_helper.analyze_table_structure_batch_async(
+                tables)
+        header_analysis_map.update(zip(table_indices, header_analyses))
+
+        results = [
+            self._build_cell_region(candidate, region_analysis,
+                                    header_analysis_map.get(i))
+            for i, (candidate, region_analysis) in enumerate(
+                zip(candidates, region_analyses))
+        ]
+        return [region for region in results if region is not None]
+
+    def _build_cell_region(
+            self, candidate: Dict[str, Any], region_analysis: Dict[str, Any],
+            header_analysis: Optional[Dict[str, Any]]
+    ) -> Optional[Dict[str, Any]]:
+        """候補領域と分析結果からセル領域のメタデータを組み立てる"""
+        row, col = candidate["row"], candidate["col"]
+        max_row, max_col = candidate["max_row"], candidate["max_col"]
+        cells_data = candidate["cells"]
+        merged_cells = candidate["mergedCells"]
+        range_str = f"{get_column_letter(col)}{row}:{get_column_letter(max_col)}{max_row}"
+
+        try:
+            region_type = region_analysis.get("regionType", "unknown")
+            region_metadata = {
+                "regionType": region_type,
+                "range": range_str,
+                "sampleCells": cells_data,
+                "mergedCells": merged_cells
+            }
+
+            if region_type == "table":
+                try:
+                    region_metadata[
+                        "headerStructure"] = RegionAnalyzer.build_header_structure(
+                            header_analysis, merged_cells, row)
+                except Exception as e:
+                    self.logger.error(
+                        f"Error analyzing table header: {str(e)}")
+                    return None
+
+            return region_metadata
+
+        except Exception as e:
+            self.logger.error(
+                f"Error analyzing region at {get_column_letter(col)}{row}: {str(e)}"
+            )
+            return None
+
+    def find_region_boundaries(
+            self,
+            sheet,
+            start_row: int,
+            start_col: int,
+            sheet_dims: Optional[Tuple[int, int]] = None) -> Tuple[int, int]:
+        return self.region_detector.find_region_boundaries(
+            sheet, start_row, start_col, sheet_dims)
 
     def get_merged_cells_info(self, sheet, start_row: int, start_col: int,
                               max_row: int,
                               max_col: int) -> List[Dict[str, Any]]:
-        region_detector = RegionDetector()
-        return region_detector.get_merged_cells_info(sheet, start_row,
-                                                     start_col, max_row,
-                                                     max_col)
+        return self.region_detector.get_merged_cells_info(
+            sheet, start_row, start_col, max_row, max_col)
 
     def get_file_metadata(self) -> Dict[str, Any]:
         try:
@@ -472,14 +569,18 @@ class ExcelMetadataExtractor:
     def get_sheet_metadata(self) -> list:
         try:
             sheets_metadata = []
-
-            for sheet_name in self.workbook.sheetnames:
-                sheet = self.workbook[sheet_name]
-
+            sheets = [
+                self.workbook[sheet_name]
+                for sheet_name in self.workbook.sheetnames
+            ]
+            # LLMによる分析はシートをまたいで並行に行う
+            sheets_regions = self.detect_regions_for_sheets(sheets)
+
+            for sheet, regions in zip(sheets, sheets_regions):
+                sheet_name = sheet.title
                 merged_cells = [
                     str(cell_range) for cell_range in sheet.merged_cells.ranges
                 ]
-                regions = self.detect_regions(sheet)
 
                 sheet_meta = {
                     "sheetName": sheet_name,
@@ -505,6 +606,13 @@ class ExcelMetadataExtractor:
         try:
             file_metadata = self.get_file_metadata()
             sheets_metadata = self.get_sheet_metadata()
+            # プロンプトキャッシュの効果はcached（入力のうち再利用された分）で確認できる
+            # ヘルパーは抽出ごとのもの（for_extraction）のため、使用量はこの抽出の呼び出し分のみ
+            usage = self.openai_helper.token_usage
+            self.logger.info(
+                f"LLM token usage: {usage['prompt_tokens']} prompt "
+                f"({usage['cached_tokens']} cached), "
+                f"{usage['completion_tokens']} completion")
 
             for sheet in sheets_metadata:
                 if "regions" in sheet:
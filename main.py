@@ -11,10 +11,13 @@ Excelファイルからメタデータを抽出・表示します。
 """
 
 import streamlit as st
-import json
+from streamlit.runtime.uploaded_file_manager import UploadedFile
+import orjson
 from excel_metadata_extractor import ExcelMetadataExtractor
+from openai_helper import OpenAIHelper
 import pandas as pd
 import traceback
+from collections import deque
 from openpyxl.utils import get_column_letter
 import os
 
@@ -23,26 +26,208 @@ def display_json_tree(data, key_prefix=""):
     """
     JSONデータをツリー形式で表示する補助関数
 
+    再帰を使わず、(ノード, キー, 描画先コンテナ) のスタックで走査する。
+    エクスパンダーは親の処理中に順番どおり生成し、中身は後から書き込む。
+
     Args:
         data: 表示するJSONデータ
         key_prefix: ネストされたキーのプレフィックス
     """
-    if isinstance(data, dict):
-        for key, value in data.items():
-            new_key = f"{key_prefix}/{key}" if key_prefix else key
-            if isinstance(value, (dict, list)):
-                with st.expander(f"🔍 {key}"):
-                    display_json_tree(value, new_key)
-            else:
-                st.text(f"{key}: {value}")
-    elif isinstance(data, list):
-        for i, item in enumerate(data):
-            new_key = f"{key_prefix}[{i}]"
-            if isinstance(item, (dict, list)):
-                with st.expander(f"📑 Item {i+1}"):
-                    display_json_tree(item, new_key)
-            else:
-                st.text(f"- {item}")
+    stack = deque([(data, key_prefix, st)])
+    while stack:
+        node, prefix, container = stack.pop()
+        children = []
+        if type(node) is dict:
+            for key, value in node.items():
+                new_key = f"{prefix}/{key}" if prefix else key
+                if type(value) is dict or type(value) is list:
+                    children.append(
+                        (value, new_key, container.expander(f"🔍 {key}")))
+                else:
+                    container.text(f"{key}: {value}")
+        elif type(node) is list:
+            for i, item in enumerate(node):
+                new_key = f"{prefix}[{i}]"
+                if type(item) is dict or type(item) is list:
+                    children.append(
+                        (item, new_key, container.expander(f"📑 Item {i+1}")))
+                else:
+                    container.text(f"- {item}")
+        stack.extend(reversed(children))
+
+
+def _render_shape(region):
+    """図形特有の情報を表示する"""
+    st.markdown("#### Shape Information")
+    cols = st.columns(2)
+    with cols[0]:
+        shape_type = region.get('shape_type')
+        if shape_type:
+            st.metric("Shape Type", shape_type.title())
+        name = region.get('name')
+        if name:
+            st.text(f"Name: {name}")
+    with cols[1]:
+        description = region.get('description')
+        if description:
+            st.text(f"Description: {description}")
+
+    text_content = region.get('text_content')
+    if text_content is not None:
+        st.markdown("#### Text Content")
+        st.text(text_content)
+
+    form_control_type = region.get('form_control_type')
+    if form_control_type is not None:
+        st.markdown("#### Form Control")
+        control_type = "チェックボックス" if form_control_type == 'checkbox' else "ラジオボタン"
+        st.write(f"種類: {control_type}")
+        st.write(
+            f"状態: {'選択済み' if region.get('form_control_state', False) else '未選択'}"
+        )
+
+
+def _render_text(region):
+    """テキスト領域のセル内容を表示する"""
+    st.markdown("#### Text Content")
+
+    sample_cells = region.get('sampleCells')
+    if sample_cells is not None:
+        text_content = []
+        for row in sample_cells:
+            for cell in row:
+                value = cell.get('value')
+                if value and str(value).strip():
+                    text_content.append(str(value).strip())
+        if text_content:
+            joined = '\n'.join(text_content)
+            st.markdown("```\n" + joined + "\n```")
+            region['text_content'] = joined
+        else:
+            st.info("No text content found in cells")
+    else:
+        st.warning("No cell data available")
+
+
+def _render_image(region):
+    """画像の分析結果を表示する"""
+    st.markdown("#### Image Analysis")
+    analysis = region.get('gpt4o_analysis')
+    if analysis:
+        print(f"Found GPT-4 analysis: {analysis}")
+        st.write("画像の種類：", analysis.get('imageType', '不明'))
+        st.write("内容：", analysis.get('content', '不明'))
+        st.write("特徴：", ", ".join(analysis.get('features', [])) or '不明')
+    else:
+        print("No analysis found in region")
+
+    if 'image_ref' in region:
+        print(f"Found image reference: {region['image_ref']}")
+        st.text(f"Reference: {region['image_ref']}")
+    else:
+        print("No image reference found in region")
+
+
+def _render_chart(region):
+    """グラフの詳細を表示する"""
+    st.markdown("#### Chart Details")
+    if 'chartType' in region:
+        st.text(f"Chart Type: {region['chartType'].title()}")
+    if 'title' in region:
+        st.text(f"Title: {region['title']}")
+    if 'series' in region:
+        st.markdown("#### Data Range")
+        for series in region['series']:
+            if 'data_range' in series:
+                st.text(f"Data Range: {series['data_range']}")
+
+
+def _render_smartart(region):
+    """SmartArtの詳細を表示する"""
+    st.markdown("#### SmartArt Details")
+    if 'diagram_type' in region:
+        st.text(f"Diagram Type: {region['diagram_type']}")
+    if 'layout_type' in region:
+        st.text(f"Layout Type: {region['layout_type']}")
+    if region.get('text_content'):
+        st.markdown("#### Text Content")
+        st.text(region['text_content'])
+    if region.get('nodes'):
+        st.markdown("#### Nodes")
+        for node in region['nodes']:
+            if node.get('text_list'):
+                st.text(" ".join(node['text_list']))
+
+
+def _render_table(region):
+    """テーブルのヘッダー構造を表示する"""
+    st.markdown("### Table Information")
+    sample_cells = region.get('sampleCells')
+    header_structure = region.get('headerStructure')
+    if header_structure is not None:
+        st.markdown("#### Header Structure")
+        cols = st.columns(3)
+        with cols[0]:
+            header_type = header_structure.get('headerType', 'Unknown')
+            st.metric("Header Type", header_type.title())
+        with cols[1]:
+            header_range = header_structure.get('headerRange', 'N/A')
+            st.metric("Header Range", header_range)
+        with cols[2]:
+            has_merged = header_structure.get('mergedCells', False)
+            st.metric("Has Merged Cells",
+                      "Yes" if has_merged else "No")
+
+        # ヘッダー列の表示
+        header_rows_indices = header_structure.get('headerRows')
+        if sample_cells is not None and header_rows_indices:
+            st.markdown("#### Header Columns")
+            start_row = header_structure['start_row']
+
+            # ヘッダー情報を列ごとに整理（空でないセルを平坦化してpandasで集約）
+            offset = int(start_row)
+            header_cells = [(cell['col'], cell['value'])
+                            for header_row_index in header_rows_indices
+                            for cell in sample_cells[int(header_row_index) -
+                                                     offset]
+                            if cell['value']]
+
+            # ヘッダー情報を表示（複合ヘッダーは " / " で連結）
+            if header_cells:
+                header_df = pd.DataFrame(
+                    header_cells, columns=['col', 'val']).drop_duplicates()
+                headers = header_df.groupby('col')['val'].agg(" / ".join)
+                for col, header_text in headers.items():
+                    st.markdown(
+                        f"- Column {get_column_letter(col)}: {header_text}")
+
+
+# 領域タイプごとの描画関数
+_HANDLERS = {
+    'shape': _render_shape,
+    'text': _render_text,
+    'image': _render_image,
+    'smartart': _render_smartart,
+    'chart': _render_chart,
+    'table': _render_table,
+}
+
+
+def show_error_details(region=None):
+    """
+    デバッグモード時のみスタックトレースと領域データを表示する
+
+    通常時はスタックトレースの整形や領域データのシリアライズを行わない。
+
+    Args:
+        region: エラーが発生した領域情報（省略可）
+    """
+    if not st.session_state.get("debug"):
+        return
+    st.code(traceback.format_exc())
+    if region is not None:
+        st.code(orjson.dumps(region, option=orjson.OPT_INDENT_2).decode(),
+                language="json")
 
 
 def display_region_info(region):
@@ -53,187 +238,87 @@ def display_region_info(region):
         region: 領域情報を含む辞書
     """
     try:
+        region_type = region['regionType']
         st.markdown("#### Region Information")
-        st.write(f"Region Type: {region['regionType']}")
+        st.write(f"Region Type: {region_type}")
         st.write(f"Range: {region['range']}")
 
-        # 図形特有の情報を表示
-        if region['regionType'] == 'shape':
-            st.markdown("#### Shape Information")
-            cols = st.columns(2)
-            with cols[0]:
-                if 'shape_type' in region and region['shape_type']:
-                    st.metric("Shape Type",
-                              region.get('shape_type', 'Unknown').title())
-                if region.get('name'):
-                    st.text(f"Name: {region['name']}")
-            with cols[1]:
-                if region.get('description'):
-                    st.text(f"Description: {region['description']}")
-
-            if 'text_content' in region:
-                st.markdown("#### Text Content")
-                st.text(region['text_content'])
-
-            if 'form_control_type' in region:
-                st.markdown("#### Form Control")
-                control_type = "チェックボックス" if region[
-                    'form_control_type'] == 'checkbox' else "ラジオボタン"
-                st.write(f"種類: {control_type}")
-                st.write(
-                    f"状態: {'選択済み' if region.get('form_control_state', False) else '未選択'}"
-                )
-
-        # テキスト領域の表示
-        elif region['regionType'] == 'text':
-            st.markdown("#### Text Content")
-
-            if 'sampleCells' in region:
-                text_content = []
-                for row in region['sampleCells']:
-                    for cell in row:
-                        if cell.get('value') and str(cell['value']).strip():
-                            text_content.append(str(cell['value']).strip())
-                if text_content:
-                    st.markdown("```\n" + '\n'.join(text_content) + "\n```")
-                    region['text_content'] = '\n'.join(text_content)
-                else:
-                    st.info("No text content found in cells")
-            else:
-                st.warning("No cell data available")
-
-        # 画像、SmartArt、グラフの情報を表示
-        elif region['regionType'] in ['image', 'smartart', 'chart']:
-            # st.markdown("#### Drawing Information")
-            # cols = st.columns(2)
-            # with cols[0]:
-            #     st.text(f"Type: {region['type'].title()}")
-            #     if region.get('name'):
-            #         st.text(f"Name: {region['name']}")
-            # with cols[1]:
-            #     if region.get('description'):
-            #         st.text(f"Description: {region['description']}")
-
-            # if 'coordinates' in region:
-            #     st.markdown("#### Position")
-            #     coords = region['coordinates']
-            #     st.text(f"From: Column {coords['from']['col']}, Row {coords['from']['row']}")
-            #     st.text(f"To: Column {coords['to']['col']}, Row {coords['to']['row']}")
-
-            # 画像分析結果の表示
-            if region['type'] == 'image':
-                st.markdown("#### Image Analysis")
-                if 'gpt4o_analysis' in region and region['gpt4o_analysis']:
-                    print(f"Found GPT-4 analysis: {region['gpt4o_analysis']}")
-                    analysis = region['gpt4o_analysis']
-                    st.write("画像の種類：", analysis.get('imageType', '不明'))
-                    st.write("内容：", analysis.get('content', '不明'))
-                    st.write("特徴：", ", ".join(analysis.get('features', []))
-                             or '不明')
-                else:
-                    print("No analysis found in region")
-
-                if 'image_ref' in region:
-                    print(f"Found image reference: {region['image_ref']}")
-                    st.text(f"Reference: {region['image_ref']}")
-                else:
-                    print("No image reference found in region")
-
-            # グラフ詳細の表示
-            elif region['type'] == 'chart':
-                st.markdown("#### Chart Details")
-                if 'chartType' in region:
-                    st.text(f"Chart Type: {region['chartType'].title()}")
-                if 'title' in region:
-                    st.text(f"Title: {region['title']}")
-                if 'series' in region:
-                    st.markdown("#### Data Range")
-                    for series in region['series']:
-                        if 'data_range' in series:
-                            st.text(f"Data Range: {series['data_range']}")
-
-            # SmartArt詳細の表示
-            elif region['type'] == 'smartart':
-                st.markdown("#### SmartArt Details")
-                if 'diagram_type' in region:
-                    st.text(f"Diagram Type: {region['diagram_type']}")
-                if 'layout_type' in region:
-                    st.text(f"Layout Type: {region['layout_type']}")
-                if 'text_content' in region and region['text_content']:
-                    st.markdown("#### Text Content")
-                    st.text(region['text_content'])
-                if 'nodes' in region and region['nodes']:
-                    st.markdown("#### Nodes")
-                    for node in region['nodes']:
-                        if 'text_list' in node and node['text_list']:
-                            st.text(" ".join(node['text_list']))
-
-        # テーブル情報の表示
-        elif region['regionType'] == 'table':
-            st.markdown("### Table Information")
-            if 'headerStructure' in region:
-                st.markdown("#### Header Structure")
-                cols = st.columns(3)
-                with cols[0]:
-                    header_type = region['headerStructure'].get(
-                        'headerType', 'Unknown')
-                    st.metric("Header Type", header_type.title())
-                with cols[1]:
-                    header_range = region['headerStructure'].get(
-                        'headerRange', 'N/A')
-                    st.metric("Header Range", header_range)
-                with cols[2]:
-                    has_merged = region['headerStructure'].get(
-                        'mergedCells', False)
-                    st.metric("Has Merged Cells",
-                              "Yes" if has_merged else "No")
-
-                # ヘッダー列の表示
-                if 'sampleCells' in region and 'headerStructure' in region and region[
-                        'headerStructure'].get('headerRows'):
-                    st.markdown("#### Header Columns")
-                    header_rows_indices = region['headerStructure'][
-                        'headerRows']
-                    start_row = region['headerStructure']['start_row']
-
-                    # ヘッダー情報を列ごとに整理
-                    header_columns = {}
-                    for header_row_index in header_rows_indices:
-                        header_row = region['sampleCells'][
-                            int(header_row_index) - int(start_row)]
-                        for cell in header_row:
-                            col_letter = get_column_letter(cell['col'])
-                            if col_letter not in header_columns:
-                                header_columns[col_letter] = []
-                            if cell['value'] and cell[
-                                    'value'] not in header_columns[col_letter]:
-                                header_columns[col_letter].append(
-                                    cell['value'])
-
-                    # ヘッダー情報を表示
-                    for col_letter, values in sorted(header_columns.items()):
-                        if values:  # 空のヘッダーは表示しない
-                            header_text = f"Column {col_letter}: "
-                            if len(values) > 1:  # 複合ヘッダーの場合
-                                header_text += " / ".join(values)
-                            else:  # 単一ヘッダーの場合
-                                header_text += values[0]
-                            st.markdown(f"- {header_text}")
-
-        # テキスト領域の表示
-        elif region['regionType'] == 'text':
-            st.markdown("Text Information")
-            if 'content' in region:
-                st.text_area("Content", region['content'], height=100)
-            if 'classification' in region:
-                st.write("Classification:", region['classification'])
-            if 'importance' in region:
-                st.write("Importance:", region['importance'])
-
+        handler = _HANDLERS.get(region_type)
+        if handler is not None:
+            handler(region)
     except Exception as e:
         st.error(f"Error displaying region info: {str(e)}")
-        st.error(f"Region data: {json.dumps(region, indent=2)}")
-        st.error(f"Stack trace:\n{traceback.format_exc()}")
+        show_error_details(region)
+
+
+def render_debug_log(debug_log):
+    """
+    デバッグモード時のみ、LLMへのプロンプトと応答の記録をまとめて表示する
+
+    抽出処理中はUIを操作せずに記録だけを行い、完了後にここで一度だけ描画する。
+
+    Args:
+        debug_log: 抽出時の記録（タスク名, プロンプト, 応答）のリスト
+    """
+    if not st.session_state.get("debug") or not debug_log:
+        return
+    with st.expander(f"🤖 LLM Debug Log ({len(debug_log)})"):
+        for task, prompt, content in debug_log:
+            st.markdown(f"**{task}**")
+            st.code(prompt)
+            st.code(content)
+
+
+@st.cache_resource(show_spinner=False)
+def get_openai_helper():
+    """
+    OpenAIHelperをプロセス内で共有する
+
+    APIクライアントのHTTP接続プールや応答キャッシュを再実行・セッションをまたいで再利用する。
+    """
+    return OpenAIHelper()
+
+
+@st.cache_data(show_spinner=False,
+               hash_funcs={UploadedFile: lambda f: (f.name, f.getvalue())})
+def extract_metadata(uploaded_file,
+                     batch_mode=False,
+                     scan_processes=1,
+                     max_concurrency=None):
+    """
+    アップロードされたファイルからメタデータを抽出する
+
+    ファイル名と内容が同じであれば再実行時にはキャッシュされた結果を返す。
+    JSONへのシリアライズと output/ への保存もここで一度だけ行い、
+    ウィジェット操作による再実行ではやり直さない。
+
+    Args:
+        uploaded_file: アップロードされたExcelファイル
+        batch_mode: TrueならLLMへの問い合わせをBatch APIで実行する
+        scan_processes: シートのセルの走査を並行に行うプロセス数（1なら順に走査する）
+        max_concurrency: この抽出で同時に発行するAPIリクエストの上限（Noneなら全セッション共通の上限のみ）
+
+    Returns:
+        (メタデータ, JSONバイト列, 保存先パス, LLMへのプロンプトと応答の記録)
+    """
+    # 共有ヘルパーの記録には他のセッションの呼び出しも含まれるため、抽出ごとに記録と同時リクエスト数の上限を分ける
+    openai_helper = get_openai_helper().for_extraction(max_concurrency)
+    extractor = ExcelMetadataExtractor(uploaded_file,
+                                       openai_helper=openai_helper,
+                                       batch_mode=batch_mode,
+                                       scan_processes=scan_processes)
+    metadata = extractor.extract_all_metadata()
+    json_bytes = orjson.dumps(metadata, option=orjson.OPT_INDENT_2)
+
+    # メタデータJSONファイルの自動生成
+    output_dir = "output"
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    output_path = os.path.join(output_dir,
+                               f"{uploaded_file.name}_metadata.json")
+    with open(output_path, "wb") as file:
+        file.write(json_bytes)
+    return metadata, json_bytes, output_path, list(openai_helper.debug_log)
 
 
 def main():
@@ -253,6 +338,24 @@ def main():
     - AI-powered analysis of content and structure
     """)
 
+    # エラー詳細（スタックトレース・領域データ）の表示切り替え
+    st.sidebar.checkbox("Show error details", key="debug")
+    # Batch APIの利用（料金は半額になるが、完了まで数分〜最大24時間かかる）
+    batch_mode = st.sidebar.checkbox("Batch mode (cheaper, slower)")
+    # この抽出で同時に発行するAPIリクエストの上限（アカウントのレート制限に合わせて調整する）
+    # 環境変数 OPENAI_MAX_CONCURRENCY の値（全セッション共通の上限・HTTP接続プールの大きさ）を超えては指定できない
+    shared_max_concurrency = get_openai_helper().max_concurrency
+    max_concurrency = st.sidebar.number_input(
+        "Max concurrent API requests",
+        min_value=1,
+        max_value=shared_max_concurrency,
+        value=shared_max_concurrency)
+    # シートのセルの走査を並行に行うプロセス数（シート数が多く各シートが大きいブック向け）
+    scan_processes = st.sidebar.number_input("Sheet scan processes",
+                                             min_value=1,
+                                             max_value=os.cpu_count() or 1,
+                                             value=1)
+
     # ファイルアップローダーの表示
     uploaded_file = st.file_uploader("Choose an Excel file",
                                      type=['xlsx', 'xlsm'])
@@ -261,8 +364,9 @@ def main():
         with st.spinner("Extracting metadata..."):
             try:
                 # メタデータの抽出
-                extractor = ExcelMetadataExtractor(uploaded_file)
-                metadata = extractor.extract_all_metadata()
+                metadata, json_bytes, output_path, debug_log = extract_metadata(
+                    uploaded_file, batch_mode, int(scan_processes),
+                    int(max_concurrency))
 
                 # セクションの表示
                 st.header("📑 Extracted Metadata")
@@ -324,31 +428,26 @@ def main():
 
                             except Exception as e:
                                 st.error(
-                                    f"Error processing region: {str(e)}\nRegion data: {json.dumps(region, indent=2)}"
-                                )
-                                st.error(
-                                    f"Stack trace:\n{traceback.format_exc()}")
+                                    f"Error processing region: {str(e)}")
+                                show_error_details(region)
 
                     st.markdown("---")  # シート間の区切り線
 
                 # 生のJSONデータ表示
+                # JSONはextract_metadataでシリアライズ済みのものを使う
                 with st.expander("🔍 Raw JSON Data"):
-                    st.json(metadata)
-
-                # メタデータJSONファイルの自動生成
-                json_str = json.dumps(metadata, indent=2, ensure_ascii=False)
-                output_dir = "output"
-                if not os.path.exists(output_dir):
-                    os.makedirs(output_dir)
-                output_path = os.path.join(
-                    output_dir, f"{uploaded_file.name}_metadata.json")
-                with open(output_path, "w", encoding="utf-8") as file:
-                    file.write(json_str)
+                    st.json(metadata)  # 辞書をそのまま渡す（再シリアライズ不要）
+                # LLMのプロンプトと応答（デバッグモード時のみ）
+                render_debug_log(debug_log)
+                st.download_button(label="📥 Download Metadata JSON",
+                                   data=json_bytes,
+                                   file_name=f"{uploaded_file.name}_metadata.json",
+                                   mime="application/json")
                 st.success(f"メタデータJSONファイルが保存されました: {output_path}")
 
             except Exception as e:
                 st.error(f"Error processing file: {str(e)}")
-                st.error(f"Detailed error:\n{traceback.format_exc()}")
+                show_error_details()
                 st.error(
                     "Please make sure you've uploaded a valid Excel file.")
 
@@ -1,159 +1,76 @@
 import os
-import json
+import asyncio
+import atexit
+import base64
+import collections
+import contextlib
+import copy
+import functools
+import hashlib
+import io
+import random
+import string
+import threading
 import traceback
-from typing import Dict, Any, Union, List
-from openai import OpenAI, AzureOpenAI
-import streamlit as st
+import cachetools
+import diskcache
+import httpx
+import numpy as np
+import openai
+import orjson
+from typing import Deque, Dict, Any, Tuple, Union, List
+from openai import OpenAI, AzureOpenAI, AsyncOpenAI, AsyncAzureOpenAI
+from openai.types import CompletionUsage
+from openpyxl.utils.cell import range_boundaries
+from PIL import Image
 from dotenv import load_dotenv
+from tenacity import (retry, retry_if_exception_type, stop_after_attempt,
+                      wait_random_exponential)
 from logger import Logger
+from rate_limiter import RateLimiter, count_tokens, estimate_tokens
+from semantic_cache import SemanticCache
 
 
-class OpenAIHelper:
-
-    def __init__(self):
-        load_dotenv()
-        self.api_type = os.environ.get("OPENAI_API_TYPE", "openai")  # "openai" or "azure"
-        
-        if self.api_type == "azure":
-            self.client = AzureOpenAI(
-                api_key=os.environ.get("AZURE_OPENAI_API_KEY"),
-                api_version=os.environ.get("AZURE_OPENAI_API_VERSION", "2024-02-15-preview"),
-                azure_endpoint=os.environ.get("AZURE_OPENAI_ENDPOINT")
-            )
-            self.model = os.environ.get("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4")
-        else:
-            self.client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-            self.model = os.environ.get("OPENAI_MODEL_NAME", "gpt-4")
-            
-        self.logger = Logger()
-
-    def summarize_region(self, region: Dict[str, Any]) -> str:
-        """Generate a summary for a region based on its content"""
-        try:
-            if region["regionType"] == "table":
-                cells = region.get("sampleCells", [])
-                header_structure = region.get("headerStructure", {})
-                prompt = ("以下のExcelテーブル領域が何について記載されているか簡潔に説明してください:\n"
-                          "ヘッダー構造: %s\n"
-                          "データサンプル: %s") % (
-                              json.dumps(header_structure, ensure_ascii=False),
-                              json.dumps(cells[:2], ensure_ascii=False))
-            elif region["regionType"] == "chart":
-                series_info = region.get('series', [])
-                data_range = series_info[0].get(
-                    'data_range') if series_info else 'N/A'
-                # self.logger.info(
-                #     f"Chart region data: {json.dumps(region, indent=2)}")
-                prompt = ("以下のグラフが何について記載されているか簡潔に説明してください:\n"
-                          "グラフタイプ: %s\n"
-                          "データ範囲: %s\n"
-                          "内容: %s") % (region.get('chartType', ''), data_range,
-                                       region.get('chart_data_json', ''))
-            elif region["regionType"] == "image":
-                gpt4o_analysis = region.get("gpt4o_analysis", {})
-                prompt = ("以下の画像について簡潔に説明してください:\n"
-                          "画像の種類: %s\n"
-                          "内容: %s\n"
-                          "特徴: %s\n"
-                          "位置: %s\n"
-                          "名前: %s\n"
-                          "説明: %s") % (gpt4o_analysis.get('imageType', '不明'),
-                                       gpt4o_analysis.get('content', '不明'),
-                                       ', '.join(
-                                           gpt4o_analysis.get('features', [])),
-                                       region['range'], region.get('name', ''),
-                                       region.get('description', ''))
-            elif region["regionType"] == "shape":
-                prompt = ("以下のExcelの図形が何について記載されているか簡潔に説明してください:\n"
-                          "内容: %s") % json.dumps(region, ensure_ascii=False)
-            else:
-                prompt = ("以下のExcel領域が何について記載されているか簡潔に説明してください:\n"
-                          "領域タイプ: %s\n"
-                          "範囲: %s\n"
-                          "内容: %s") % (region['regionType'], region['range'],
-                                       json.dumps(region, ensure_ascii=False))
-
-            self.logger.gpt_prompt(prompt)
-            response = self.client.chat.completions.create(model="gpt-4o",
-                                                           messages=[{
-                                                               "role":
-                                                               "user",
-                                                               "content":
-                                                               prompt
-                                                           }],
-                                                           max_tokens=1000)
-            response_content = response.choices[0].message.content
-            self.logger.gpt_response(response_content)
-            return response_content
-        except Exception as e:
-            print(f"Error generating summary: {str(e)}")
-            return "サマリーの生成に失敗しました"
-
-    def analyze_region_type(self, region_data: str) -> Dict[str, Any]:
-        """Analyze region type using LLM with size limits"""
-        try:
-            data = json.loads(region_data)
-            sample_data = {
-                "cells": data["cells"],
-                "mergedCells": data.get("mergedCells", [])
-            }
+# プロンプトの固定部分（呼び出しごとに組み立て直さないようモジュール定数として保持）
+# 指示とJSONスキーマはsystemメッセージにまとめ、呼び出し間でバイト単位で同一に保つ
+# （OpenAIのプロンプトキャッシュが先頭の共通部分に効くようにするため）。可変のデータはuserメッセージで渡す。
+_COMPACT_CELLS_NOTE = """
+cells is tab-separated text. The first line lists the column numbers; each following line
+starts with the row number followed by the values of that row (empty cells are empty fields,
+every cell of a merged range repeats its value, and tabs/newlines in values are written as \\t/\\n).
+mergedCells lists merged ranges in A1 notation.
+"""
 
-            prompt = """
-Analyze the following Excel region sample data and determine:
+_REGION_CRITERIA = """
 1. The type of region (table, text, chart, image)
 2. If it contains a table title or document heading
 3. The purpose or meaning of the content, considering Japanese text patterns
+"""
 
-Region sample data (first few rows/cells):
-{data}
-
+_JAPANESE_PATTERNS_NOTE = """
 Consider Japanese text patterns like:
 - Table titles (一覧表, 集計表, リスト)
 - Section headings (大項目, 中項目, 小項目)
 - Data categories (区分, 分類, 種別)
+"""
 
+_REGION_SCHEMA = _JAPANESE_PATTERNS_NOTE + """
 Respond in JSON format:
-{{
+{
     "regionType": "table" or "text" or "chart" or "image",
-    "title": {{
+    "title": {
         "detected": boolean,
         "content": string or null,
         "row": number or null
-    }},
+    },
     "characteristics": [string],
     "purpose": string,
     "confidence": number
-}}
-""".format(data=json.dumps(sample_data, indent=2))
-
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{
-                    "role": "user",
-                    "content": prompt
-                }],
-                response_format={"type": "json_object"},
-                max_tokens=2000)
-            return json.loads(response.choices[0].message.content)
-        except Exception as e:
-            print(f"Error in analyze_region_type: {str(e)}")
-            return {
-                "regionType": "unknown",
-                "title": {
-                    "detected": False,
-                    "content": None,
-                    "row": None
-                },
-                "characteristics": [],
-                "purpose": "Error in analysis",
-                "confidence": 0
-            }
+}
+Keep "characteristics" to at most 3 short phrases and "purpose" to one short sentence.
+"""
 
-    def analyze_table_structure(self, cells_data: str,
-                                merged_cells) -> Dict[str, Any]:
-        """Analyze table structure using LLM with size limits"""
-        prompt = """
-Analyze the following Excel cells sample data and determine:
+_TABLE_CRITERIA = """
 1. Title row detection (例: 売上実績表, 商品マスタ一覧)
 2. Header structure (single/multiple header rows)
 
@@ -164,76 +81,131 @@ Analyze the following Excel cells sample data and determine:
 - 結合セルの使用
 - 合計行や総計、小計の行はヘッダーに含めないこと
 
-Sample data(Refer to the rows and columns (row and col) for accurate interpretation of the structure):
-
-{cells}
+Refer to the row and column numbers for accurate interpretation of the structure.
+The sample contains only the first rows of the table and the rows that include merged cells.
+また、mergedCellsのセルは結合されているのでヘッダー検知の参考にしてください。
+"""
 
-また、以下のセルは結合されているのでヘッダー検知の参考にしてください。
-{merged}
+_TABLE_SCHEMA = """
+Respond in JSON format:
+{
+    "titleRow": {
+        "detected": boolean,
+        "content": string or null,
+        "row": number or null
+    },
+    "headerStructure": {
+        "type": "single" or "multiple" or "none",
+        "rows": [row_indices],
+        "reason": string
+    },
+    "confidence": number
+}
+Keep "reason" to one short sentence.
+"""
 
+# 種類判定とヘッダー判定を1回で行う場合のスキーマ（テーブル以外は headerStructure を null にする）
+_REGION_STRUCTURE_SCHEMA = _JAPANESE_PATTERNS_NOTE + """
 Respond in JSON format:
-{{
-    "titleRow": {{
+{
+    "regionType": "table" or "text" or "chart" or "image",
+    "title": {
         "detected": boolean,
         "content": string or null,
         "row": number or null
-    }},
-    "headerStructure": {{
+    },
+    "characteristics": [string],
+    "purpose": string,
+    "headerStructure": {
         "type": "single" or "multiple" or "none",
         "rows": [row_indices],
         "reason": string
-    }},
+    } or null,
     "confidence": number
-}}
-""".format(cells=cells_data, merged=merged_cells)
+}
+Set "headerStructure" only when regionType is "table"; otherwise set it to null.
+Keep "characteristics" to at most 3 short phrases, and "purpose" and "reason" to one short sentence each.
+"""
 
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{
-                    "role": "user",
-                    "content": prompt
-                }],
-                response_format={"type": "json_object"},
-                temperature=0)
-            return json.loads(response.choices[0].message.content)
-        except Exception as e:
-            print(f"Error in analyze_table_structure: {str(e)}")
-            return {
-                "titleRow": {
-                    "detected": False,
-                    "content": None,
-                    "row": None
-                },
-                "headerStructure": {
-                    "type": "none",
-                    "rows": [],
-                    "hierarchy": None
-                },
-                "columns": [],
-                "confidence": 0
-            }
+_BATCH_RESULT_FORMAT = """
+Return one result object in the format above per task_id, wrapped as:
+{"results": [{"task_id": string, "result": {...}}]}
+"""
 
-    def generate_sheet_summary(self, sheet_data: Dict[str, Any]) -> str:
-        """Generate a summary for an entire sheet using LLM with region summaries already available."""
-        try:
-            regions = sheet_data.get('regions', [])
-            region_summaries = []
+_REGION_SYSTEM_PROMPT = (
+    "Analyze the Excel region sample data (first few rows/cells) given by "
+    "the user and determine:\n" + _REGION_CRITERIA + _COMPACT_CELLS_NOTE +
+    _REGION_SCHEMA)
 
-            for region in regions:
-                if "summary" in region:
-                    region_type = region.get("regionType", "unknown")
-                    region_range = region.get("range", "")
-                    summary = region.get("summary", "")
-                    region_summaries.append(
-                        "%s (%s): %s" % (region_type, region_range, summary))
+_REGION_BATCH_SYSTEM_PROMPT = (
+    "Analyze each Excel region in the task list given by the user "
+    "independently and determine:\n" + _REGION_CRITERIA +
+    "\nEach task has a task_id and the sample data (first few rows/cells) "
+    "of one region.\n" + _COMPACT_CELLS_NOTE + _REGION_SCHEMA +
+    _BATCH_RESULT_FORMAT)
 
-            prompt = """以下はExcelシートから抽出された情報です。各領域の情報をよく理解したうえで記載されていることを客観的に推測を交えずに説明してください。:
-シート名: %s
-検出された領域数: %s
+_REGION_STRUCTURE_SYSTEM_PROMPT = (
+    "Analyze the Excel region sample data given by the user and determine:\n"
+    + _REGION_CRITERIA + "\nIf the region is a table, also determine:\n" +
+    _TABLE_CRITERIA + _COMPACT_CELLS_NOTE + _REGION_STRUCTURE_SCHEMA)
 
-各領域の要約:
-%s
+_REGION_STRUCTURE_BATCH_SYSTEM_PROMPT = (
+    "Analyze each Excel region in the task list given by the user "
+    "independently and determine:\n" + _REGION_CRITERIA +
+    "\nIf the region is a table, also determine:\n" + _TABLE_CRITERIA +
+    "\nEach task has a task_id and the sample data of one region.\n" +
+    _COMPACT_CELLS_NOTE + _REGION_STRUCTURE_SCHEMA + _BATCH_RESULT_FORMAT)
+
+_TABLE_SYSTEM_PROMPT = (
+    "Analyze the Excel table sample data given by the user and determine:\n"
+    + _TABLE_CRITERIA + _COMPACT_CELLS_NOTE + _TABLE_SCHEMA)
+
+_TABLE_BATCH_SYSTEM_PROMPT = (
+    "Analyze each Excel table in the task list given by the user "
+    "independently and determine:\n" + _TABLE_CRITERIA +
+    "\nEach task has a task_id and the sample data of one table.\n" +
+    _COMPACT_CELLS_NOTE + _TABLE_SCHEMA + _BATCH_RESULT_FORMAT)
+
+# 複数領域の要約をまとめて生成する場合のsystemプロンプト（各領域のプロンプトはuserメッセージで渡す）
+_SUMMARY_BATCH_SYSTEM_PROMPT = """
+Each item in the list given by the user has an id and a prompt asking about one Excel region.
+Answer each prompt independently, in Japanese, exactly as if it had been asked on its own.
+Respond in JSON format:
+{"summaries": {"<id>": "<answer>"}}
+"""
+
+# サマリー生成用のプロンプトテンプレート（呼び出しごとには値の埋め込みだけを行う）
+_TABLE_SUMMARY_TEMPLATE = string.Template(
+    "以下のExcelテーブル領域が何について記載されているか簡潔に説明してください:\n"
+    "ヘッダー構造: $header_structure\n"
+    "データサンプル: $sample_cells")
+
+_CHART_SUMMARY_TEMPLATE = string.Template(
+    "以下のグラフが何について記載されているか簡潔に説明してください:\n"
+    "グラフタイプ: $chart_type\n"
+    "データ範囲: $data_range\n"
+    "内容: $content")
+
+_IMAGE_SUMMARY_TEMPLATE = string.Template(
+    "以下の画像について簡潔に説明してください:\n"
+    "画像の種類: $image_type\n"
+    "内容: $content\n"
+    "特徴: $features\n"
+    "位置: $range\n"
+    "名前: $name\n"
+    "説明: $description")
+
+_SHAPE_SUMMARY_TEMPLATE = string.Template(
+    "以下のExcelの図形が何について記載されているか簡潔に説明してください:\n"
+    "内容: $content")
+
+_REGION_SUMMARY_TEMPLATE = string.Template(
+    "以下のExcel領域が何について記載されているか簡潔に説明してください:\n"
+    "領域タイプ: $region_type\n"
+    "範囲: $range\n"
+    "内容: $content")
+
+_SHEET_SUMMARY_SYSTEM_PROMPT = """以下はExcelシートから抽出された情報です。各領域の情報をよく理解したうえで記載されていることを客観的に推測を交えずに説明してください。
 
 以下の点に注目して要約してください:
 - シートの主な目的や内容
@@ -244,26 +216,16 @@ Respond in JSON format:
 - 表/グラフの見た目や内容の特徴をしっかりとらえて要約してください。
 - sheetに含まれていない情報は含めないでください。
 - 推測で記載しないでください。
-""" % (sheet_data.get('sheetName',
-                      ''), len(regions), "\n".join(region_summaries))
-            response = self.client.chat.completions.create(model=self.model,
-                                                           messages=[{
-                                                               "role":
-                                                               "user",
-                                                               "content":
-                                                               prompt
-                                                           }],
-                                                           max_tokens=2000)
-
-            return response.choices[0].message.content
-        except Exception as e:
-            print(f"Error generating sheet summary: {str(e)}")
-            return "シートのサマリー生成に失敗しました"
+"""
 
-    def analyze_image_with_gpt4o(self, base64_image: str) -> Dict[str, Any]:
-        """GPT-4o APIを使用して画像を分析"""
-        try:
-            prompt = """
+_SHEET_SUMMARY_TEMPLATE = string.Template("""シート名: $sheet_name
+検出された領域数: $region_count
+
+各領域の要約:
+$region_summaries
+""")
+
+_IMAGE_PROMPT = """
 この画像について以下の点を分析してください：
 1. 画像の種類（グラフ、図表、写真など）
 2. 主な内容や目的
@@ -276,74 +238,1519 @@ Respond in JSON format:
     "features": ["特徴1", "特徴2", ...]
 }
 """
+
+# 画像分析に渡す画像の長辺の上限（detailごと）
+# detail: low はAPI側でも512px四方に縮小されるため、先に縮小して送信データを減らす
+# detail: high はAPI側で2048px四方に収めてから512pxのタイルに分割される
+_IMAGE_MAX_SIZES = {"low": 512, "high": 2048}
+
+
+@functools.lru_cache(maxsize=32)
+def _downscale_image(base64_image: str, max_size: int) -> str:
+    """
+    base64エンコードされた画像を max_size 四方に収まるようPNGで縮小する
+
+    縮小の必要がない画像や、Pillowで読み込めない形式（EMF/WMF等）は元のデータをそのまま返す。
+    先行取得と分析で同じ画像を2回変換しないよう結果を保持する。
+    """
+    try:
+        with Image.open(io.BytesIO(base64.b64decode(base64_image))) as image:
+            if max(image.size) <= max_size:
+                return base64_image
+            image.thumbnail((max_size, max_size))
+            if image.mode == "CMYK":
+                image = image.convert("RGB")
+            buffer = io.BytesIO()
+            image.save(buffer, "PNG", optimize=True)
+    except Exception:
+        return base64_image
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+def _project_cell(cell: Dict[str, Any]) -> Dict[str, Any]:
+    """セル情報を分類に必要な行・列・値だけの短縮形 {r, c, v} に変換"""
+    return {"r": cell.get("row"), "c": cell.get("col"), "v": cell.get("value")}
+
+
+def _compact_cells(cells: List[Any]) -> List[Any]:
+    """セルデータ（行ごとのリスト、またはセルのリスト）を短縮形に変換"""
+    return [[_project_cell(c) for c in row] if isinstance(row, list) else
+            _project_cell(row) for row in cells]
+
+
+def _compact_merged(merged_cells: List[Any]) -> List[str]:
+    """結合セル情報を範囲文字列のみのリストに変換"""
+    return [m["range"] if isinstance(m, dict) else str(m) for m in merged_cells]
+
+
+# TSV中の値でエスケープする文字（区切りのタブ・改行とエスケープ文字自体）
+_TSV_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def _cells_to_tsv(cells: List[Any]) -> str:
+    """
+    セルデータ（行ごとのリスト、またはセルのリスト）をタブ区切りの表に変換
+
+    1行目は列番号、以降の各行は行番号とその行の値を並べる。セルごとにJSONで
+    行・列・値を書くより大幅に短く、行・列と値の対応は失われない。
+    """
+    rows: Dict[Any, Dict[Any, Any]] = {}
+    for row in cells:
+        for cell in (row if isinstance(row, list) else [row]):
+            rows.setdefault(cell.get("row"), {})[cell.get("col")] = cell.get(
+                "value")
+    columns = sorted({col for values in rows.values() for col in values},
+                     key=lambda col: (col is None, col))
+    lines = ["\t".join(["row"] + [str(col) for col in columns])]
+    for row, values in rows.items():
+        lines.append("\t".join([str(row)] + [
+            "" if values.get(col) is None else str(values[col]).translate(
+                _TSV_ESCAPES) for col in columns
+        ]))
+    return "\n".join(lines)
+
+
+# 要約用に領域から取り出す項目（セル全体などの大きな項目はシリアライズしない）
+_BRIEF_REGION_KEYS = ("regionType", "range", "name", "description",
+                      "text_content", "form_control_type",
+                      "form_control_state", "diagram_type")
+# 要約に渡す先頭のセル行数
+_BRIEF_SAMPLE_ROWS = 2
+
+
+def _brief_region(region: Dict[str, Any]) -> Dict[str, Any]:
+    """要約のプロンプトに埋め込む、領域の主要な項目と先頭数行のセルだけの辞書を作る"""
+    brief = {
+        key: region[key]
+        for key in _BRIEF_REGION_KEYS if region.get(key) not in (None, "")
+    }
+    sample_cells = region.get("sampleCells")
+    if sample_cells:
+        brief["firstCells"] = _compact_cells(
+            sample_cells[:_BRIEF_SAMPLE_ROWS])
+    return brief
+
+
+def _table_summary_prompt(region: Dict[str, Any]) -> str:
+    """テーブル領域の要約プロンプト（ヘッダー構造と先頭2行のセル）"""
+    return _TABLE_SUMMARY_TEMPLATE.substitute(
+        header_structure=orjson.dumps(region.get("headerStructure",
+                                                 {})).decode(),
+        sample_cells=orjson.dumps(region.get("sampleCells", [])[:2]).decode())
+
+
+def _chart_summary_prompt(region: Dict[str, Any]) -> str:
+    """グラフ領域の要約プロンプト（グラフの種類・データ範囲・系列データ）"""
+    series_info = region.get('series', [])
+    data_range = series_info[0].get('data_range') if series_info else 'N/A'
+    return _CHART_SUMMARY_TEMPLATE.substitute(
+        chart_type=region.get('chartType', ''),
+        data_range=data_range,
+        content=region.get('chart_data_json', ''))
+
+
+def _image_summary_prompt(region: Dict[str, Any]) -> str:
+    """画像領域の要約プロンプト（画像分析の結果と位置・名前）"""
+    gpt4o_analysis = region.get("gpt4o_analysis", {})
+    return _IMAGE_SUMMARY_TEMPLATE.substitute(
+        image_type=gpt4o_analysis.get('imageType', '不明'),
+        content=gpt4o_analysis.get('content', '不明'),
+        features=', '.join(gpt4o_analysis.get('features', [])),
+        range=region['range'],
+        name=region.get('name', ''),
+        description=region.get('description', ''))
+
+
+def _shape_summary_prompt(region: Dict[str, Any]) -> str:
+    """図形領域の要約プロンプト"""
+    return _SHAPE_SUMMARY_TEMPLATE.substitute(
+        content=orjson.dumps(_brief_region(region)).decode())
+
+
+def _region_summary_prompt(region: Dict[str, Any]) -> str:
+    """その他の領域の要約プロンプト"""
+    return _REGION_SUMMARY_TEMPLATE.substitute(
+        region_type=region['regionType'],
+        range=region['range'],
+        content=orjson.dumps(_brief_region(region)).decode())
+
+
+# 領域の種類ごとの要約プロンプトの組み立て関数（該当しない種類は_region_summary_prompt）
+_SUMMARY_PROMPT_BUILDERS = {
+    "table": _table_summary_prompt,
+    "chart": _chart_summary_prompt,
+    "image": _image_summary_prompt,
+    "shape": _shape_summary_prompt,
+}
+
+
+# ヘッダー判定に渡す先頭の行数（これに加えて結合セルを含む行も渡す）
+_TABLE_SAMPLE_ROWS = 5
+
+
+def _header_candidate_rows(cells: List[Any],
+                           merged_ranges: List[str]) -> List[Any]:
+    """ヘッダー判定に必要な行（先頭の数行と結合セルを含む行）だけを残す"""
+    merged_rows = set()
+    for merged_range in merged_ranges:
+        _, min_row, _, max_row = range_boundaries(merged_range)
+        merged_rows.update(range(min_row, max_row + 1))
+    return [
+        row for i, row in enumerate(cells) if i < _TABLE_SAMPLE_ROWS or (
+            isinstance(row, list) and row and row[0].get("row") in merged_rows)
+    ]
+
+
+# この確信度を超えた事前判定の結果はLLMに問い合わせずにそのまま使う
+_HEURISTIC_CONFIDENCE = 0.9
+
+
+def _classify_region_heuristic(data: Dict[str, Any]) -> Tuple[str, float]:
+    """
+    セルの配置・型・結合状況から領域の種類を推定し、(種類, 確信度) を返す
+
+    - 3行2列以上でほぼ全セルが埋まり、先頭行が文字列・本体の半数以上が数値/日付 → table
+    - 8割を超えるセルが結合セル、または長い文字列が1列に並ぶ → text
+    いずれにも当てはまらない場合は確信度0を返す。
+    """
+    rows = [
+        row if isinstance(row, list) else [row]
+        for row in data.get("cells", [])
+    ]
+    height = len(rows)
+    width = max((len(row) for row in rows), default=0)
+    if width == 0:
+        return "unknown", 0.0
+
+    # セルの属性は1回の走査でリストにまとめてから配列に一括変換する（要素ごとの代入は遅い）
+    # 列数の足りない行は空のセルで埋める
+    cells = [
+        cell for row in rows for cell in row + [{}] * (width - len(row))
+    ]
+    lengths = np.array([
+        0 if value in (None, "") else len(str(value))
+        for value in (cell.get("value") for cell in cells)
+    ],
+                       dtype=np.int32).reshape(height, width)
+    filled = lengths > 0
+    numeric = np.array(
+        [cell.get("type") in ("numeric", "date") for cell in cells],
+        dtype=bool).reshape(height, width)
+    merged = np.array([bool(cell.get("isMerged")) for cell in cells],
+                      dtype=bool).reshape(height, width)
+
+    if merged.mean() > 0.8:
+        return "text", 0.95
+
+    if height >= 3 and width >= 2 and filled.mean() >= 0.8:
+        header_is_text = filled[0].mean() >= 0.8 and not numeric[0].any()
+        body_filled = filled[1:]
+        if header_is_text and body_filled.any() and (
+                numeric[1:][body_filled].mean() >= 0.5):
+            return "table", 0.95
+
+    if width == 1 and not numeric.any() and filled.any() and (
+            lengths[filled].mean() >= 20):
+        return "text", 0.95
+
+    return "unknown", 0.0
+
+
+# 分析失敗時の応答（シリアライズ済みのものを毎回デコードして新しい辞書を返す）
+_REGION_TYPE_FALLBACK = orjson.dumps({
+    "regionType": "unknown",
+    "title": {
+        "detected": False,
+        "content": None,
+        "row": None
+    },
+    "characteristics": [],
+    "purpose": "Error in analysis",
+    "confidence": 0
+})
+
+_TABLE_STRUCTURE_FALLBACK = orjson.dumps({
+    "titleRow": {
+        "detected": False,
+        "content": None,
+        "row": None
+    },
+    "headerStructure": {
+        "type": "none",
+        "rows": [],
+        "hierarchy": None
+    },
+    "columns": [],
+    "confidence": 0
+})
+
+# 応答トークン数の上限（スキーマのキー数×約30トークンを目安に設定）
+# 構造分析（種類判定・ヘッダー判定）のJSON応答はキー10個程度
+_ANALYSIS_MAX_TOKENS = 300
+# 種類判定とヘッダー判定をまとめたJSON応答はキー15個程度
+_REGION_STRUCTURE_MAX_TOKENS = 450
+# 画像分析のJSON応答（3キー＋日本語の説明文）
+_IMAGE_MAX_TOKENS = 400
+# 領域ごとの簡潔な要約
+_SUMMARY_MAX_TOKENS = 500
+# シート全体の要約
+_SHEET_SUMMARY_MAX_TOKENS = 1000
+
+# 一時的なエラー（レート制限・接続断・タイムアウト・5xx）は指数バックオフで再試行する
+# asyncio.TimeoutError は request_timeout を超えて応答が止まった非同期呼び出し
+_RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError,
+                     openai.APITimeoutError, openai.InternalServerError,
+                     asyncio.TimeoutError)
+_MAX_ATTEMPTS = 5
+
+
+def _log_retry(retry_state) -> None:
+    """再試行の待機前に失敗内容をログに記録"""
+    helper = retry_state.args[0]
+    error = retry_state.outcome.exception()
+    helper.logger.info(
+        f"OpenAI API call failed ({type(error).__name__}), retrying "
+        f"{retry_state.attempt_number}/{_MAX_ATTEMPTS - 1} "
+        f"in {retry_state.next_action.sleep:.1f}s")
+
+
+_backoff_wait = wait_random_exponential(min=1, max=20)
+# サーバーが指定した待機時間（Retry-After）を採用する上限（秒）
+_MAX_RETRY_AFTER = 60
+
+
+def _retry_wait(retry_state) -> float:
+    """
+    再試行までの待機秒数を返す
+
+    429等の応答に Retry-After（Azureでは retry-after-ms）が付いていればその時間に
+    少しのジッターを加えて待ち、なければジッター付き指数バックオフで待つ。
+    """
+    response = getattr(retry_state.outcome.exception(), "response", None)
+    if response is not None:
+        headers = response.headers
+        try:
+            if "retry-after-ms" in headers:
+                retry_after = float(headers["retry-after-ms"]) / 1000
+            else:
+                retry_after = float(headers["retry-after"])
+        except (KeyError, ValueError):
+            pass
+        else:
+            return min(retry_after, _MAX_RETRY_AFTER) + random.uniform(0, 1)
+    return _backoff_wait(retry_state)
+
+
+_api_retry = retry(wait=_retry_wait,
+                   stop=stop_after_attempt(_MAX_ATTEMPTS),
+                   retry=retry_if_exception_type(_RETRYABLE_ERRORS),
+                   before_sleep=_log_retry,
+                   reraise=True)
+
+# ストリーミングでJSONが完結した後、トークン使用量のチャンクを待つ上限（秒）
+_STREAM_USAGE_WAIT = 1.0
+
+# Batch APIのジョブが終了したことを示すステータス
+_BATCH_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+# 非同期クライアントはイベントループに紐づくため、プロセス共通の常駐ループで実行する
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _get_event_loop() -> asyncio.AbstractEventLoop:
+    """バックグラウンドスレッドで動作する共有イベントループを取得"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever,
+                             name="openai-helper-loop",
+                             daemon=True).start()
+    return _loop
+
+
+# APIクライアントはプロセス内で共有し、HTTP接続プールをヘルパーのインスタンス間で使い回す
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _env_max_concurrency() -> int:
+    """環境変数で指定された同時リクエスト数の上限"""
+    return int(os.environ.get("OPENAI_MAX_CONCURRENCY", "20"))
+
+
+def _get_clients(api_type: str):
+    """api_typeごとの共有クライアント（同期・非同期）を取得（初回呼び出し時に生成）"""
+    with _clients_lock:
+        if api_type not in _clients:
+            # HTTP/2 + keep-aliveで接続を使い回し、呼び出しごとのTCP/TLSハンドシェイクを避ける
+            # 接続数は同時リクエスト数の上限に合わせる（不足すると接続待ちやAPIConnectionErrorになる）
+            max_concurrency = _env_max_concurrency()
+            http_limits = httpx.Limits(
+                max_keepalive_connections=max_concurrency,
+                max_connections=max_concurrency * 2,
+                keepalive_expiry=60)
+            http_timeout = httpx.Timeout(60.0, connect=10.0)
+            http = httpx.Client(http2=True,
+                                timeout=http_timeout,
+                                limits=http_limits)
+            ahttp = httpx.AsyncClient(http2=True,
+                                      timeout=http_timeout,
+                                      limits=http_limits)
+
+            if api_type == "azure":
+                client_kwargs = dict(
+                    api_key=os.environ.get("AZURE_OPENAI_API_KEY"),
+                    api_version=os.environ.get("AZURE_OPENAI_API_VERSION",
+                                               "2024-02-15-preview"),
+                    azure_endpoint=os.environ.get("AZURE_OPENAI_ENDPOINT"),
+                    max_retries=0  # 再試行は_api_retryで行う
+                )
+                client = AzureOpenAI(**client_kwargs, http_client=http)
+                aclient = AsyncAzureOpenAI(**client_kwargs, http_client=ahttp)
+            else:
+                client_kwargs = dict(
+                    api_key=os.environ.get("OPENAI_API_KEY"),
+                    max_retries=0  # 再試行は_api_retryで行う
+                )
+                client = OpenAI(**client_kwargs, http_client=http)
+                aclient = AsyncOpenAI(**client_kwargs, http_client=ahttp)
+            _clients[api_type] = (client, aclient, http, ahttp)
+        return _clients[api_type][:2]
+
+
+@atexit.register
+def _close_clients() -> None:
+    """プロセス終了時に共有クライアントのHTTP接続を閉じる"""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for _, _, http, ahttp in clients:
+        http.close()
+        # 非同期クライアントは生成・利用したイベントループ上で閉じる
+        if _loop is not None and _loop.is_running():
+            try:
+                asyncio.run_coroutine_threadsafe(ahttp.aclose(),
+                                                 _loop).result(timeout=5)
+            except Exception as e:
+                print(f"Error closing async HTTP client: {str(e)}")
+
+
+class OpenAIHelper:
+
+    def __init__(self, cache_enabled: bool = True):
+        """
+        Args:
+            cache_enabled: Falseなら応答キャッシュを参照・保存せず、毎回APIを呼び出す
+        """
+        load_dotenv()
+        self.api_type = os.environ.get("OPENAI_API_TYPE", "openai")  # "openai" or "azure"
+        # APIクライアントは最初の呼び出し時に生成する（領域抽出のみでLLMを使わない場合は生成しない）
+        self._client = None
+        self._aclient = None
+        if self.api_type == "azure":
+            self.model = os.environ.get("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4")
+            self.fast_model = os.environ.get(
+                "AZURE_OPENAI_FAST_DEPLOYMENT_NAME", "gpt-4o-mini")
+            self.embedding_model = os.environ.get(
+                "AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME",
+                "text-embedding-3-small")
+        else:
+            self.model = os.environ.get("OPENAI_MODEL_NAME", "gpt-4")
+            self.fast_model = os.environ.get("OPENAI_FAST_MODEL_NAME",
+                                             "gpt-4o-mini")
+            self.embedding_model = os.environ.get("OPENAI_EMBEDDING_MODEL_NAME",
+                                                  "text-embedding-3-small")
+
+        self.batch_size = 8  # 1回のリクエストでまとめて種類判定する領域数
+        self.summary_batch_size = 20  # 1回のリクエストでまとめて要約する領域数
+        self.region_sample_rows = 5  # 種類判定に渡す先頭の行数（呼び出し側でもこの行数に切り詰める）
+        self.batch_poll_interval = 30  # Batch APIの状態確認の間隔（秒）
+        # 非同期呼び出しで接続・チャンク間の待ち時間の上限（秒）。応答が止まった呼び出しは打ち切って再試行する
+        self.request_timeout = float(
+            os.environ.get("OPENAI_REQUEST_TIMEOUT", "30"))
+        # アカウントのレート制限（RPM/TPM）を超えないようリクエストの発行を調整する
+        # 環境変数で指定しなければ、最初の応答ヘッダーに含まれるアカウントの上限に合わせる
+        self._calibrate_limits = not any(
+            name in os.environ for name in
+            ("OPENAI_MAX_REQUESTS_PER_MINUTE", "OPENAI_MAX_TOKENS_PER_MINUTE"))
+        self.rate_limiter = RateLimiter(
+            int(os.environ.get("OPENAI_MAX_REQUESTS_PER_MINUTE", "500")),
+            int(os.environ.get("OPENAI_MAX_TOKENS_PER_MINUTE", "200000")))
+        # 同一リクエストへの応答をディスクに保持し、再実行時のAPI呼び出しを省く
+        # 保持期間（秒）を過ぎた応答は破棄して問い合わせ直す（0なら期限なし）
+        self.cache_enabled = cache_enabled
+        self.cache_ttl = int(os.environ.get("OPENAI_CACHE_TTL", "86400")) or None
+        self._cache = diskcache.Cache(".llm_cache") if cache_enabled else None
+        # 直近の応答はメモリ上にも保持し、ディスクの読み込みを省く（複数スレッドから参照される）
+        self._memory_cache = (cachetools.TTLCache(maxsize=4096,
+                                                  ttl=self.cache_ttl)
+                              if self.cache_ttl else
+                              cachetools.LRUCache(maxsize=4096))
+        # 領域の要約は、埋め込みベクトルが近いプロンプトへの過去の応答も再利用する（任意）
+        # 言い換えを許容できる要約のみが対象で、構造分析は完全一致のキャッシュのみを使う
+        self.semantic_cache = None
+        if cache_enabled and os.environ.get("OPENAI_SEMANTIC_CACHE",
+                                            "false").lower() == "true":
+            self.semantic_cache = SemanticCache(
+                self._cache,
+                f"summary:{self.embedding_model}:{self.fast_model}",
+                threshold=float(
+                    os.environ.get("OPENAI_SEMANTIC_CACHE_THRESHOLD", "0.95")),
+                ttl=self.cache_ttl)
+        self._memory_cache_lock = threading.Lock()
+        # 実行中のリクエスト（キャッシュキー → 応答のFuture）。共有イベントループ上でのみ参照する
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # LLMへのプロンプトと応答の記録（タスク名, プロンプト, 応答）。UIは抽出完了後にまとめて表示する
+        self.debug_log: Deque[Tuple[str, str, str]] = collections.deque(
+            maxlen=200)
+        self.logger = Logger()
+        # APIが報告したトークン使用量の累計（cached_tokensはプロンプトキャッシュに一致した入力トークン数）
+        self.token_usage: collections.Counter = collections.Counter()
+        self._usage_lock = threading.Lock()
+        # 同時に発行するAPIリクエストの上限（全シート・全領域、共有ヘルパーでは全セッションの呼び出しで共有する）
+        # HTTP接続プールの大きさと同じ値のため、実行中に変更しない
+        self.max_concurrency = _env_max_concurrency()
+        self._api_semaphore = asyncio.Semaphore(self.max_concurrency)
+        # 抽出ごとの上限（for_extractionで指定した場合のみ。共有の上限の枠と合わせて取得する）
+        self._run_semaphore = contextlib.nullcontext()
+
+    @property
+    def client(self) -> Union[OpenAI, AzureOpenAI]:
+        """同期APIクライアント（初回参照時に共有クライアントを取得）"""
+        if self._client is None:
+            self._client, self._aclient = _get_clients(self.api_type)
+        return self._client
+
+    @property
+    def aclient(self) -> Union[AsyncOpenAI, AsyncAzureOpenAI]:
+        """非同期APIクライアント（初回参照時に共有クライアントを取得）"""
+        if self._aclient is None:
+            self._client, self._aclient = _get_clients(self.api_type)
+        return self._aclient
+
+    def for_extraction(self,
+                       max_concurrency: Union[int, None] = None) -> "OpenAIHelper":
+        """
+        1回の抽出で使うヘルパーを返す
+
+        APIクライアント・応答キャッシュ・レート制限・同時リクエスト数の上限はこのヘルパーと共有し、
+        プロンプトと応答の記録・トークン使用量はこの抽出の呼び出し分だけを保持する
+        （複数のセッションから共有ヘルパーを使う場合に、他の抽出の記録や使用量が混ざらないようにする）。
+
+        Args:
+            max_concurrency: この抽出で同時に発行するAPIリクエストの上限
+                             （共有の上限 max_concurrency を超える値は共有の上限に切り詰める。Noneなら共有の上限のみ）
+        """
+        helper = copy.copy(self)
+        helper.debug_log = collections.deque(maxlen=self.debug_log.maxlen)
+        helper.token_usage = collections.Counter()
+        helper._usage_lock = threading.Lock()
+        if max_concurrency is not None:
+            helper.max_concurrency = min(max_concurrency, self.max_concurrency)
+            helper._run_semaphore = asyncio.Semaphore(helper.max_concurrency)
+        return helper
+
+    def run_async(self, coro):
+        """コルーチンを共有イベントループで実行し、結果を返す"""
+        return asyncio.run_coroutine_threadsafe(coro, _get_event_loop()).result()
+
+    @staticmethod
+    def _cache_key(request: Dict[str, Any]) -> str:
+        """リクエスト内容のBLAKE2bハッシュをキャッシュキーとして返す"""
+        return hashlib.blake2b(orjson.dumps(request,
+                                            option=orjson.OPT_SORT_KEYS),
+                               digest_size=16).hexdigest()
+
+    def _cache_get(self, key: str) -> Union[str, None]:
+        """メモリ→ディスクの順にキャッシュを参照し、応答本文を返す"""
+        if not self.cache_enabled:
+            return None
+        with self._memory_cache_lock:
+            content = self._memory_cache.get(key)
+        if content is None:
+            content = self._cache.get(key)
+            if content is not None:
+                with self._memory_cache_lock:
+                    self._memory_cache[key] = content
+        return content
+
+    def _store_response(self, key: str, request: Dict[str, Any],
+                        content: str) -> None:
+        """応答をキャッシュに保存（JSONモードで不正なJSONの応答は保存しない）"""
+        if not self.cache_enabled:
+            return
+        if request.get("response_format", {}).get("type") == "json_object":
             try:
-                # APIリクエストのデバッグ情報
-                print("\nSending request to gpt-4o API...")
-                print(f"Image data length: {len(base64_image)}")
+                orjson.loads(content)
+            except orjson.JSONDecodeError:
+                return
+        with self._memory_cache_lock:
+            self._memory_cache[key] = content
+        self._cache.set(key, content, expire=self.cache_ttl)
+
+    def _calibrate_rate_limits(self, headers) -> None:
+        """
+        応答ヘッダーのアカウント上限（x-ratelimit-limit-*）にレート制限を合わせる
+
+        上限を環境変数で指定していない場合のみ行う。モデルごとに上限が異なるため、
+        これまでに見た中で最も小さい値を採用する。ヘッダーのないAzureでは何もしない。
+        """
+        if not self._calibrate_limits:
+            return
+        try:
+            max_requests = int(headers["x-ratelimit-limit-requests"])
+            max_tokens = int(headers["x-ratelimit-limit-tokens"])
+        except (KeyError, ValueError):
+            return
+        if self.rate_limiter.set_limits(max_requests, max_tokens):
+            self.logger.info(
+                f"Rate limits calibrated from API response: "
+                f"{self.rate_limiter.max_requests_per_minute} RPM, "
+                f"{self.rate_limiter.max_tokens_per_minute} TPM")
+
+    def _record_usage(self, usage: Union[CompletionUsage, None]) -> None:
+        """応答のトークン使用量を累計に加える"""
+        if usage is None:
+            return
+        details = usage.prompt_tokens_details
+        cached_tokens = (details.cached_tokens if details is not None else
+                         None) or 0
+        with self._usage_lock:
+            self.token_usage["prompt_tokens"] += usage.prompt_tokens
+            self.token_usage["cached_tokens"] += cached_tokens
+            self.token_usage["completion_tokens"] += usage.completion_tokens
+
+    @_api_retry
+    def _create(self, request: Dict[str, Any]):
+        """Chat Completions APIを呼び出す（一時的なエラーは再試行）"""
+        self.rate_limiter.acquire_sync(estimate_tokens(request))
+        raw = self.client.chat.completions.with_raw_response.create(**request)
+        self._calibrate_rate_limits(raw.headers)
+        response = raw.parse()
+        self._record_usage(response.usage)
+        return response
+
+    @_api_retry
+    async def _create_async(self, request: Dict[str, Any]) -> str:
+        """
+        _createの非同期版（応答本文を返す）
+
+        応答はストリーミングで受け取り、JSONモードではJSONが閉じた時点で受信を打ち切る。
+        応答が request_timeout 秒以上止まった場合は asyncio.TimeoutError として再試行する。
+        """
+        await self.rate_limiter.acquire(estimate_tokens(request))
+        async with self._run_semaphore, self._api_semaphore:
+            return await self._stream_completion(request)
+
+    async def _stream_completion(self, request: Dict[str, Any]) -> str:
+        """
+        応答をストリーミングで受信して本文を返す（JSONモードではJSONとして完結した時点で返す）
+
+        接続から最初のチャンクまで、およびチャンク間が request_timeout 秒を超えたら
+        止まった接続とみなして asyncio.TimeoutError を送出する（長い応答自体は打ち切らない）。
+        OpenAIではJSONの完結後、トークン使用量を含む最後のチャンクを短時間だけ待って記録する。
+        """
+        json_mode = request.get("response_format",
+                                {}).get("type") == "json_object"
+        # stream_optionsに対応していないAzureのAPIバージョンがあるため、OpenAIでのみ指定する
+        include_usage = self.api_type != "azure"
+        if include_usage:
+            request = {**request, "stream_options": {"include_usage": True}}
+        raw = await asyncio.wait_for(
+            self.aclient.chat.completions.with_raw_response.create(
+                **request, stream=True), self.request_timeout)
+        self._calibrate_rate_limits(raw.headers)
+        stream = raw.parse()
+        chunks = stream.__aiter__()
+        parts = []
+        loop = asyncio.get_running_loop()
+        usage_deadline = None  # JSONの完結後、使用量のチャンクを待つ期限
+        try:
+            while True:
+                timeout = (self.request_timeout if usage_deadline is None else
+                           usage_deadline - loop.time())
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(),
+                                                   timeout)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    if usage_deadline is None:
+                        raise
+                    break  # 使用量は記録しない
+                if chunk.usage is not None:  # 使用量は最後のチャンクで届く
+                    self._record_usage(chunk.usage)
+                    break
+                if usage_deadline is not None or not chunk.choices:
+                    continue  # choicesが空なのはAzureのコンテンツフィルター結果など
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                parts.append(delta)
+                # JSONモードでは閉じ括弧を含むチャンクでのみ完結を確認する
+                if json_mode and "}" in delta:
+                    try:
+                        orjson.loads("".join(parts))
+                    except orjson.JSONDecodeError:
+                        continue
+                    if not include_usage:
+                        break
+                    usage_deadline = loop.time() + _STREAM_USAGE_WAIT
+        finally:
+            await stream.close()
+        return "".join(parts)
+
+    @_api_retry
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        """テキストの埋め込みベクトルをまとめて取得する（一時的なエラーは再試行）"""
+        self.rate_limiter.acquire_sync(sum(map(count_tokens, texts)))
+        response = self.client.embeddings.create(model=self.embedding_model,
+                                                 input=texts)
+        return np.array([item.embedding for item in response.data],
+                        dtype=np.float32)
+
+    @_api_retry
+    async def _embed_async(self, texts: List[str]) -> np.ndarray:
+        """_embedの非同期版"""
+        await self.rate_limiter.acquire(sum(map(count_tokens, texts)))
+        async with self._run_semaphore, self._api_semaphore:
+            response = await asyncio.wait_for(
+                self.aclient.embeddings.create(model=self.embedding_model,
+                                               input=texts),
+                self.request_timeout)
+        return np.array([item.embedding for item in response.data],
+                        dtype=np.float32)
+
+    def _chat_completion(self, **request) -> str:
+        """キャッシュを参照しつつChat Completions APIを呼び出し、応答本文を返す"""
+        key = self._cache_key(request)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+        response = self._create(request)
+        content = response.choices[0].message.content
+        self._store_response(key, request, content)
+        return content
+
+    async def _chat_completion_async(self, **request) -> str:
+        """
+        _chat_completionの非同期版
+
+        同じリクエストが実行中であれば新たに呼び出さず、その応答を待って共有する。
+        """
+        key = self._cache_key(request)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            # 待っている側が取り消されても、実行中の呼び出しは取り消さない
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            content = await self._create_async(request)
+            self._store_response(key, request, content)
+            future.set_result(content)
+            return content
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 待つ側がいない場合に未取得の例外として警告されないようにする
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _submit_batch_async(self, requests: Dict[str, Dict[str,
+                                                                  Any]]) -> str:
+        """custom_id → リクエストの辞書をBatch APIに投入し、バッチIDを返す"""
+        url = ("/chat/completions"
+               if self.api_type == "azure" else "/v1/chat/completions")
+        batch_input = b"\n".join(
+            orjson.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": url,
+                "body": body
+            }) for custom_id, body in requests.items())
+        input_file = await self.aclient.files.create(
+            file=("batch_input.jsonl", batch_input), purpose="batch")
+        batch = await self.aclient.batches.create(
+            input_file_id=input_file.id,
+            endpoint=url,
+            completion_window="24h")
+        self.logger.info(
+            f"Submitted batch {batch.id} ({len(requests)} requests)")
+        return batch.id
+
+    async def _wait_for_batch_async(self, batch_id: str) -> Dict[str, str]:
+        """バッチの終了を待ち、custom_id → 応答本文の辞書を返す"""
+        while True:
+            batch = await self.aclient.batches.retrieve(batch_id)
+            if batch.status in _BATCH_TERMINAL_STATUSES:
+                break
+            counts = batch.request_counts
+            if counts is not None:
+                self.logger.info(
+                    f"Batch {batch_id}: {batch.status} "
+                    f"({counts.completed}/{counts.total} completed)")
+            await asyncio.sleep(self.batch_poll_interval)
+
+        if not batch.output_file_id:
+            self.logger.error(
+                f"Batch {batch_id} finished without output: {batch.status}")
+            return {}
+
+        output = await self.aclient.files.content(batch.output_file_id)
+        results = {}
+        for line in output.content.splitlines():
+            item = orjson.loads(line)
+            response = item.get("response") or {}
+            if response.get("status_code") == 200:
+                results[item["custom_id"]] = response["body"]["choices"][0][
+                    "message"]["content"]
+                if response["body"].get("usage"):
+                    self._record_usage(
+                        CompletionUsage.model_validate(
+                            response["body"]["usage"]))
+        return results
+
+    async def _prefetch_batch_async(self,
+                                    requests: List[Dict[str, Any]]) -> None:
+        """
+        未キャッシュのリクエストをBatch APIでまとめて実行し、応答をキャッシュに格納する
+
+        通常の呼び出しと同じキーで格納するため、以降の analyze_* / summarize_* は
+        APIを呼ばずにキャッシュから応答を返す。失敗した分は通常の呼び出しで処理される。
+        """
+        pending = {}
+        for request in requests:
+            key = self._cache_key(request)
+            if self._cache_get(key) is None:
+                pending[key] = request
+        if not pending:
+            return
+
+        try:
+            batch_id = await self._submit_batch_async(pending)
+            results = await self._wait_for_batch_async(batch_id)
+        except Exception as e:
+            print(f"Error in batch processing: {str(e)}")
+            return
+        for key, content in results.items():
+            self._store_response(key, pending[key], content)
+
+    async def prefetch_tasks_async(self, task: str,
+                                   args_list: List[tuple]) -> None:
+        """分析タスク（region_type / table_structure）の応答をBatch APIで先に取得する"""
+        build = self._TASKS[task][0]
+        requests = []
+        for args in args_list:
+            try:
+                request, local_result = build(self, *args)
+            except Exception:
+                continue  # 組み立てに失敗したものは通常の呼び出しでフォールバックする
+            if local_result is None:
+                requests.append(request)
+        await self._prefetch_batch_async(requests)
+
+    async def prefetch_summaries_async(self,
+                                       regions: List[Dict[str, Any]]) -> None:
+        """領域サマリーの応答をBatch APIで先に取得する"""
+        requests = []
+        for region in regions:
+            try:
+                requests.append(self._summary_request(region))
+            except Exception:
+                continue
+        await self._prefetch_batch_async(requests)
+
+    async def prefetch_images_async(self,
+                                    images: List[str],
+                                    detail: str = "low") -> None:
+        """画像分析（base64エンコードされた画像）の応答をBatch APIで先に取得する"""
+        await self._prefetch_batch_async(
+            [self._image_request(image, detail) for image in images])
+
+    def _summary_prompt(self, region: Dict[str, Any]) -> str:
+        """領域の種類に応じた要約のプロンプトを組み立てる"""
+        prompt = _SUMMARY_PROMPT_BUILDERS.get(region["regionType"],
+                                              _region_summary_prompt)(region)
+
+        self.logger.gpt_prompt(prompt)
+        return prompt
+
+    def _summary_request(self, region: Dict[str, Any]) -> Dict[str, Any]:
+        """summarize_region用のリクエストパラメータを組み立てる"""
+        # 領域ごとの要約は件数が多く単純な作業のため、軽量モデルで行う
+        return dict(model=self.fast_model,
+                    messages=[{
+                        "role": "user",
+                        "content": self._summary_prompt(region)
+                    }],
+                    temperature=0,
+                    max_tokens=_SUMMARY_MAX_TOKENS)
+
+    def _semantic_lookup(
+        self, prompts: List[str]
+    ) -> Tuple[Union[np.ndarray, None], List[Union[str, None]]]:
+        """
+        要約のプロンプトを埋め込み、近い過去の応答を返す
+
+        埋め込みに失敗した場合はキャッシュなしとして扱い、ベクトルにNoneを返す。
+        """
+        try:
+            vectors = self._embed(prompts)
+        except Exception as e:
+            print(f"Error in semantic cache lookup: {str(e)}")
+            return None, [None] * len(prompts)
+        return vectors, self.semantic_cache.lookup(vectors)
 
-                response = self.client.chat.completions.create(
-                    model="gpt-4o",
+    async def _semantic_lookup_async(
+        self, prompts: List[str]
+    ) -> Tuple[Union[np.ndarray, None], List[Union[str, None]]]:
+        """_semantic_lookupの非同期版"""
+        try:
+            vectors = await self._embed_async(prompts)
+        except Exception as e:
+            print(f"Error in semantic cache lookup: {str(e)}")
+            return None, [None] * len(prompts)
+        return vectors, self.semantic_cache.lookup(vectors)
+
+    def summarize_region(self, region: Dict[str, Any]) -> str:
+        """Generate a summary for a region based on its content"""
+        try:
+            request = self._summary_request(region)
+            vector = None
+            if (self.semantic_cache is not None and
+                    self._cache_get(self._cache_key(request)) is None):
+                vector, (cached, ) = self._semantic_lookup(
+                    [request["messages"][0]["content"]])
+                if cached is not None:
+                    self._record("summary", request, cached)
+                    return cached
+            response_content = self._chat_completion(**request)
+            if vector is not None:
+                self.semantic_cache.add(vector, [response_content])
+            self.logger.gpt_response(response_content)
+            self._record("summary", request, response_content)
+            return response_content
+        except Exception as e:
+            print(f"Error generating summary: {str(e)}")
+            return "サマリーの生成に失敗しました"
+
+    async def summarize_region_async(self, region: Dict[str, Any]) -> str:
+        """summarize_regionの非同期版"""
+        try:
+            request = self._summary_request(region)
+            vector = None
+            if (self.semantic_cache is not None and
+                    self._cache_get(self._cache_key(request)) is None):
+                vector, (cached, ) = await self._semantic_lookup_async(
+                    [request["messages"][0]["content"]])
+                if cached is not None:
+                    self._record("summary", request, cached)
+                    return cached
+            response_content = await self._chat_completion_async(**request)
+            if vector is not None:
+                self.semantic_cache.add(vector, [response_content])
+            self.logger.gpt_response(response_content)
+            self._record("summary", request, response_content)
+            return response_content
+        except Exception as e:
+            print(f"Error generating summary: {str(e)}")
+            return "サマリーの生成に失敗しました"
+
+    def _summary_batch_request(self,
+                               items: List[Dict[str, str]]) -> Dict[str, Any]:
+        """複数領域の要約をまとめて生成するリクエストを組み立てる"""
+        return dict(model=self.fast_model,
+                    messages=[{
+                        "role": "system",
+                        "content": _SUMMARY_BATCH_SYSTEM_PROMPT
+                    }, {
+                        "role": "user",
+                        "content": orjson.dumps(items).decode()
+                    }],
+                    response_format={"type": "json_object"},
+                    temperature=0,
+                    max_tokens=_SUMMARY_MAX_TOKENS * len(items))
+
+    async def summarize_regions_async(
+            self, regions: List[Dict[str, Any]]) -> List[str]:
+        """
+        複数領域の要約をsummary_batch_size件ずつ1つのプロンプトにまとめて生成し、入力順に返す
+
+        応答に含まれなかった領域、または失敗したまとまりの領域は個別に要約する。
+        プロンプトが同じ領域は最初の1件のみ問い合わせて同じ要約を使う。semantic_cacheが有効なら、近い過去の応答がある領域は問い合わせず、
+        互いに近い領域は代表の1件のみ問い合わせて同じ要約を使う。
+        """
+        summaries: List[Any] = [None] * len(regions)
+        items = []
+        for i, region in enumerate(regions):
+            try:
+                items.append({
+                    "id": str(i),
+                    "prompt": self._summary_prompt(region)
+                })
+            except Exception:
+                continue  # 個別の要約でフォールバックさせる
+
+        duplicates: Dict[str, str] = {}  # プロンプトが同じ領域ID → 最初の領域ID
+        first_ids: Dict[str, str] = {}
+        for item in items:
+            first_id = first_ids.setdefault(item["prompt"], item["id"])
+            if first_id != item["id"]:
+                duplicates[item["id"]] = first_id
+        items = [item for item in items if item["id"] not in duplicates]
+
+        vectors: Dict[str, np.ndarray] = {}  # 問い合わせる領域ID → 埋め込みベクトル
+        followers: Dict[str, str] = {}  # 代表に要約を任せる領域ID → 代表の領域ID
+        if self.semantic_cache is not None and items:
+            embedded, cached = await self._semantic_lookup_async(
+                [item["prompt"] for item in items])
+            if embedded is not None:
+                misses = []
+                for item, vector, summary in zip(items, embedded, cached):
+                    if summary is not None:
+                        summaries[int(item["id"])] = summary
+                    else:
+                        misses.append(item)
+                        vectors[item["id"]] = vector
+                groups = self.semantic_cache.group(
+                    np.array([vectors[item["id"]] for item in misses]))
+                items = []
+                for i, (item, leader) in enumerate(zip(misses, groups)):
+                    if leader == i:
+                        items.append(item)
+                    else:
+                        followers[item["id"]] = misses[leader]["id"]
+                self.logger.info(
+                    f"Semantic cache: {len(embedded) - len(items)} of "
+                    f"{len(embedded)} summaries reused")
+
+        answered: List[str] = []  # まとめた問い合わせで要約を得た領域ID
+
+        async def run_chunk(chunk: List[Dict[str, str]]) -> None:
+            try:
+                request = self._summary_batch_request(chunk)
+                content = await self._chat_completion_async(**request)
+                self._record("summary", request, content)
+                chunk_ids = {item["id"] for item in chunk}
+                for key, summary in orjson.loads(content).get(
+                        "summaries", {}).items():
+                    if key in chunk_ids and isinstance(summary,
+                                                       str) and summary:
+                        summaries[int(key)] = summary
+                        answered.append(key)
+            except Exception as e:
+                print(f"Error in batch summary: {str(e)}")
+
+        await asyncio.gather(*[
+            run_chunk(items[i:i + self.summary_batch_size])
+            for i in range(0, len(items), self.summary_batch_size)
+        ])
+
+        if vectors:
+            answered = [key for key in answered if key in vectors]
+            self.semantic_cache.add(np.array([vectors[key] for key in answered]),
+                                    [summaries[int(key)] for key in answered])
+            for key, leader in followers.items():
+                summaries[int(key)] = summaries[int(leader)]
+
+        async def run_single(i: int) -> None:
+            summaries[i] = await self.summarize_region_async(regions[i])
+
+        await asyncio.gather(*[
+            run_single(i) for i, summary in enumerate(summaries)
+            if summary is None and str(i) not in duplicates
+        ])
+        for key, first_id in duplicates.items():
+            summaries[int(key)] = summaries[int(first_id)]
+        return summaries
+
+    @staticmethod
+    def _classify_region_locally(
+            data: Dict[str, Any]) -> Union[Dict[str, Any], None]:
+        """LLMを使わずに判定できる領域（空・単一セル・事前判定で確信度が高いもの）の分析結果を返す。判定できなければNone"""
+        cells = data.get("cells", [])
+        values = [
+            c.get("value") for row in cells
+            for c in (row if isinstance(row, list) else [row])
+            if c.get("value") not in (None, "")
+        ]
+        if not values:
+            result = orjson.loads(_REGION_TYPE_FALLBACK)
+            result["purpose"] = "Empty region"
+        elif len(values) == 1 and not data.get("mergedCells"):
+            result = {
+                "regionType": "text",
+                "title": {
+                    "detected": False,
+                    "content": None,
+                    "row": None
+                },
+                "characteristics": ["single cell"],
+                "purpose": str(values[0]),
+                "confidence": 1
+            }
+        else:
+            region_type, confidence = _classify_region_heuristic(data)
+            if confidence <= _HEURISTIC_CONFIDENCE:
+                return None
+            result = {
+                "regionType": region_type,
+                "title": {
+                    "detected": False,
+                    "content": None,
+                    "row": None
+                },
+                "characteristics": ["heuristic"],
+                "purpose": "",
+                "confidence": confidence
+            }
+        result["used_llm"] = False
+        return result
+
+    def _region_type_sample(self, region_data: Dict[str, Any]):
+        """種類判定に渡すサンプルを組み立てる（ローカルで判定できればその結果を返す）"""
+        local_result = self._classify_region_locally(region_data)
+        if local_result is not None:
+            return None, local_result
+        return {
+            "cells":
+            _cells_to_tsv(region_data["cells"][:self.region_sample_rows]),
+            "mergedCells": _compact_merged(region_data.get("mergedCells", []))
+        }, None
+
+    def _region_type_request(self, region_data: Dict[str, Any]):
+        """analyze_region_type用のリクエストを組み立てる（ローカルで判定できればその結果を返す）"""
+        sample_data, local_result = self._region_type_sample(region_data)
+        if local_result is not None:
+            return None, local_result
+
+        return dict(model=self.fast_model,
+                    messages=[{
+                        "role": "system",
+                        "content": _REGION_SYSTEM_PROMPT
+                    }, {
+                        "role": "user",
+                        "content": orjson.dumps(sample_data).decode()
+                    }],
+                    response_format={"type": "json_object"},
+                    temperature=0,
+                    max_tokens=_ANALYSIS_MAX_TOKENS), None
+
+    def _table_structure_sample(self, cells_data: List[Any],
+                                merged_cells: List[Any]):
+        """ヘッダー判定に渡すサンプルを組み立てる（本体の行は除き、ヘッダー候補の行だけを渡す）"""
+        merged_ranges = _compact_merged(merged_cells)
+        rows = _header_candidate_rows(cells_data, merged_ranges)
+        return {
+            "cells": _cells_to_tsv(rows),
+            "mergedCells": merged_ranges
+        }, None
+
+    def _table_structure_request(self, cells_data: List[Any],
+                                 merged_cells: List[Any]):
+        """analyze_table_structure用のリクエストを組み立てる"""
+        sample_data, _ = self._table_structure_sample(cells_data,
+                                                      merged_cells)
+        return dict(model=self.fast_model,
+                    messages=[{
+                        "role": "system",
+                        "content": _TABLE_SYSTEM_PROMPT
+                    }, {
+                        "role": "user",
+                        "content": orjson.dumps(sample_data).decode()
+                    }],
+                    response_format={"type": "json_object"},
+                    temperature=0,
+                    max_tokens=_ANALYSIS_MAX_TOKENS), None
+
+    def select_sample_rows(self, cells: List[Any],
+                           merged_cells: List[Any]) -> List[Any]:
+        """
+        LLMに渡す行（先頭の数行と結合セルを含む行）だけを選ぶ
+
+        呼び出し側で先に切り詰め、使われない行を分析の入力に含めないために使う。
+        """
+        return _header_candidate_rows(cells, _compact_merged(merged_cells))
+
+    def _region_and_structure_sample(self, region_data: Dict[str, Any]):
+        """種類判定とヘッダー判定に渡すサンプルを組み立てる（ローカルで判定できればその結果を返す）"""
+        local_result = self._classify_region_locally(region_data)
+        if local_result is not None:
+            return None, local_result
+        merged_ranges = _compact_merged(region_data.get("mergedCells", []))
+        rows = _header_candidate_rows(region_data["cells"], merged_ranges)
+        return {
+            "cells": _cells_to_tsv(rows),
+            "mergedCells": merged_ranges
+        }, None
+
+    def _region_and_structure_request(self, region_data: Dict[str, Any]):
+        """analyze_region_and_structure用のリクエストを組み立てる（ローカルで判定できればその結果を返す）"""
+        sample_data, local_result = self._region_and_structure_sample(
+            region_data)
+        if local_result is not None:
+            return None, local_result
+        return dict(model=self.fast_model,
+                    messages=[{
+                        "role": "system",
+                        "content": _REGION_STRUCTURE_SYSTEM_PROMPT
+                    }, {
+                        "role": "user",
+                        "content": orjson.dumps(sample_data).decode()
+                    }],
+                    response_format={"type": "json_object"},
+                    temperature=0,
+                    max_tokens=_REGION_STRUCTURE_MAX_TOKENS), None
+
+    def _record(self, task: str, request: Dict[str, Any],
+                content: str) -> None:
+        """プロンプト（最後のメッセージ）と応答をデバッグログに追加する"""
+        self.debug_log.append(
+            (task, str(request["messages"][-1]["content"]), content))
+
+    # タスク名 → (リクエスト組み立て関数, 失敗時の応答, バッチ用サンプル組み立て関数, バッチ用systemプロンプト,
+    #             1件あたりの応答トークン数の上限)
+    _TASKS = {
+        "region_type":
+        (_region_type_request, _REGION_TYPE_FALLBACK, _region_type_sample,
+         _REGION_BATCH_SYSTEM_PROMPT, _ANALYSIS_MAX_TOKENS),
+        "table_structure":
+        (_table_structure_request, _TABLE_STRUCTURE_FALLBACK,
+         _table_structure_sample, _TABLE_BATCH_SYSTEM_PROMPT,
+         _ANALYSIS_MAX_TOKENS),
+        "region_and_structure":
+        (_region_and_structure_request, _REGION_TYPE_FALLBACK,
+         _region_and_structure_sample, _REGION_STRUCTURE_BATCH_SYSTEM_PROMPT,
+         _REGION_STRUCTURE_MAX_TOKENS),
+    }
+
+    def _run(self, task: str, *args) -> Dict[str, Any]:
+        """タスクのリクエストを組み立ててLLMで実行し、JSON応答を辞書で返す"""
+        build, fallback = self._TASKS[task][:2]
+        try:
+            request, local_result = build(self, *args)
+            if local_result is not None:
+                return local_result
+            content = self._chat_completion(**request)
+            self._record(task, request, content)
+            result = orjson.loads(content)
+            result["used_llm"] = True
+            return result
+        except Exception as e:
+            print(f"Error in {task} analysis: {str(e)}")
+            return orjson.loads(fallback)
+
+    async def _run_async(self, task: str, *args) -> Dict[str, Any]:
+        """_runの非同期版"""
+        build, fallback = self._TASKS[task][:2]
+        try:
+            request, local_result = build(self, *args)
+            if local_result is not None:
+                return local_result
+            content = await self._chat_completion_async(**request)
+            self._record(task, request, content)
+            result = orjson.loads(content)
+            result["used_llm"] = True
+            return result
+        except Exception as e:
+            print(f"Error in {task} analysis: {str(e)}")
+            return orjson.loads(fallback)
+
+    def _batch_request(self, task: str,
+                       tasks: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """複数の入力をまとめて1回で分析するリクエストを組み立てる"""
+        return dict(model=self.fast_model,
+                    messages=[{
+                        "role": "system",
+                        "content": self._TASKS[task][3]
+                    }, {
+                        "role": "user",
+                        "content": orjson.dumps(tasks).decode()
+                    }],
+                    response_format={"type": "json_object"},
+                    temperature=0,
+                    max_tokens=self._TASKS[task][4] * len(tasks))
+
+    async def _run_batch_async(self, task: str,
+                               args_list: List[tuple]) -> List[Dict[str, Any]]:
+        """
+        タスクの入力をbatch_size件ずつ1つのプロンプトにまとめてLLMに問い合わせ、入力順に結果を返す
+
+        バッチ応答に含まれなかった入力、または失敗したバッチの入力は個別に分析する。
+        サンプルが同じ入力は最初の1件のみ問い合わせて同じ結果を使う。
+        """
+        build_sample = self._TASKS[task][2]
+        results: List[Any] = [None] * len(args_list)
+        tasks = []
+        duplicates: Dict[int, int] = {}  # サンプルが同じ入力の位置 → 最初の入力の位置
+        first_indexes: Dict[bytes, int] = {}
+        for i, args in enumerate(args_list):
+            try:
+                sample_data, local_result = build_sample(self, *args)
+            except Exception:
+                continue  # 個別の分析でフォールバックさせる
+            if local_result is not None:
+                results[i] = local_result
+                continue
+            first_index = first_indexes.setdefault(
+                orjson.dumps(sample_data, option=orjson.OPT_SORT_KEYS), i)
+            if first_index != i:
+                duplicates[i] = first_index
+            else:
+                tasks.append({"task_id": str(i), **sample_data})
+
+        async def run_chunk(chunk: List[Dict[str, Any]]) -> None:
+            try:
+                request = self._batch_request(task, chunk)
+                content = await self._chat_completion_async(**request)
+                self._record(task, request, content)
+                items = orjson.loads(content).get("results", [])
+            except Exception as e:
+                print(f"Error in {task} batch analysis: {str(e)}")
+                return
+            # このチャンクで送ったtask_idの結果のみ使う（他のチャンク・重複・ローカル判定の入力には書き込まない）
+            chunk_ids = {t["task_id"] for t in chunk}
+            for item in items:
+                if not isinstance(item, dict):
+                    continue
+                task_id = str(item.get("task_id"))
+                if task_id not in chunk_ids:
+                    continue
+                index = int(task_id)
+                if results[index] is None and isinstance(
+                        item.get("result"), dict):
+                    results[index] = item["result"]
+                    results[index]["used_llm"] = True
+
+        await asyncio.gather(*[
+            run_chunk(tasks[i:i + self.batch_size])
+            for i in range(0, len(tasks), self.batch_size)
+        ])
+
+        async def run_single(i: int) -> None:
+            results[i] = await self._run_async(task, *args_list[i])
+
+        await asyncio.gather(*[
+            run_single(i) for i, result in enumerate(results)
+            if result is None and i not in duplicates
+        ])
+        for i, first_index in duplicates.items():
+            results[i] = dict(results[first_index])
+        return results
+
+    def analyze_region_and_structure(
+            self, region_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        領域の種類判定と、テーブルの場合のヘッダー判定を1回の問い合わせで行う
+
+        region_data は {"cells": 行ごとのセル情報, "mergedCells": 結合セル情報} の辞書。
+
+        結果は analyze_region_type の項目に加え、テーブルと判定された場合は
+        analyze_table_structure と同じ形式の headerStructure を含む（それ以外はnull）。
+        ローカルで判定した領域には headerStructure が含まれない。
+        """
+        return self._run("region_and_structure", region_data)
+
+    async def analyze_region_and_structure_async(
+            self, region_data: Dict[str, Any]) -> Dict[str, Any]:
+        """analyze_region_and_structureの非同期版"""
+        return await self._run_async("region_and_structure", region_data)
+
+    async def analyze_region_and_structure_batch_async(
+            self, region_data_list: List[Dict[str,
+                                             Any]]) -> List[Dict[str, Any]]:
+        """複数領域の種類判定・ヘッダー判定をまとめて行い、入力順に結果を返す"""
+        return await self._run_batch_async(
+            "region_and_structure", [(region_data, )
+                                     for region_data in region_data_list])
+
+    def analyze_region_type(self, region_data: Dict[str,
+                                                    Any]) -> Dict[str, Any]:
+        """
+        Analyze region type using LLM with size limits
+
+        非推奨: テーブルのヘッダー判定も必要な場合は analyze_region_and_structure を使う。
+        """
+        return self._run("region_type", region_data)
+
+    async def analyze_region_type_async(
+            self, region_data: Dict[str, Any]) -> Dict[str, Any]:
+        """analyze_region_typeの非同期版"""
+        return await self._run_async("region_type", region_data)
+
+    async def analyze_region_type_batch_async(
+            self, region_data_list: List[Dict[str,
+                                             Any]]) -> List[Dict[str, Any]]:
+        """複数領域の種類判定をまとめて行い、入力順に結果を返す"""
+        return await self._run_batch_async(
+            "region_type", [(region_data, )
+                            for region_data in region_data_list])
+
+    def analyze_table_structure(self, cells_data: List[Any],
+                                merged_cells: List[Any]) -> Dict[str, Any]:
+        """Analyze table structure using LLM with size limits"""
+        return self._run("table_structure", cells_data, merged_cells)
+
+    async def analyze_table_structure_async(
+            self, cells_data: List[Any],
+            merged_cells: List[Any]) -> Dict[str, Any]:
+        """analyze_table_structureの非同期版"""
+        return await self._run_async("table_structure", cells_data,
+                                     merged_cells)
+
+    async def analyze_table_structure_batch_async(
+            self, tables: List[tuple]) -> List[Dict[str, Any]]:
+        """複数テーブルのヘッダー判定をまとめて行い、入力順に結果を返す（要素は (cells_data, merged_cells)）"""
+        return await self._run_batch_async("table_structure", tables)
+
+    def _sheet_summary_request(self, sheet_data: Dict[str, Any]) -> Dict[str, Any]:
+        """generate_sheet_summary用のリクエストパラメータを組み立てる"""
+        regions = sheet_data.get('regions', [])
+        region_summaries = []
+
+        for region in regions:
+            if "summary" in region:
+                region_type = region.get("regionType", "unknown")
+                region_range = region.get("range", "")
+                summary = region.get("summary", "")
+                region_summaries.append(
+                    "%s (%s): %s" % (region_type, region_range, summary))
+
+        prompt = _SHEET_SUMMARY_TEMPLATE.substitute(
+            sheet_name=sheet_data.get('sheetName', ''),
+            region_count=len(regions),
+            region_summaries="\n".join(region_summaries))
+        return dict(model=self.model,
+                    messages=[{
+                        "role": "system",
+                        "content": _SHEET_SUMMARY_SYSTEM_PROMPT
+                    }, {
+                        "role": "user",
+                        "content": prompt
+                    }],
+                    temperature=0,
+                    max_tokens=_SHEET_SUMMARY_MAX_TOKENS)
+
+    def generate_sheet_summary(self, sheet_data: Dict[str, Any]) -> str:
+        """Generate a summary for an entire sheet using LLM with region summaries already available."""
+        try:
+            return self._chat_completion(
+                **self._sheet_summary_request(sheet_data))
+        except Exception as e:
+            print(f"Error generating sheet summary: {str(e)}")
+            return "シートのサマリー生成に失敗しました"
+
+    async def generate_sheet_summary_async(self,
+                                           sheet_data: Dict[str, Any]) -> str:
+        """generate_sheet_summaryの非同期版"""
+        try:
+            return await self._chat_completion_async(
+                **self._sheet_summary_request(sheet_data))
+        except Exception as e:
+            print(f"Error generating sheet summary: {str(e)}")
+            return "シートのサマリー生成に失敗しました"
+
+    def _image_request(self,
+                       base64_image: str,
+                       detail: str = "low") -> Dict[str, Any]:
+        """analyze_image_with_gpt4o用のリクエストパラメータを組み立てる（画像はdetailに合わせて縮小する）"""
+        image_data = _downscale_image(base64_image, _IMAGE_MAX_SIZES[detail])
+        return dict(model="gpt-4o",
                     messages=[{
                         "role":
                         "user",
                         "content": [{
                             "type": "text",
-                            "text": prompt
+                            "text": _IMAGE_PROMPT
                         }, {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/png;base64,{base64_image}"
+                                "url": f"data:image/png;base64,{image_data}",
+                                "detail": detail
                             }
                         }]
                     }],
-                    max_tokens=500,
+                    temperature=0,
+                    max_tokens=_IMAGE_MAX_TOKENS,
                     response_format={"type": "json_object"})
 
-                # APIレスポンスのデバッグ情報
-                print("\ngpt-4o API Response:")
-                print(f"Response status: Success")
-                print(
-                    f"Response content: {response.choices[0].message.content}")
-
-                # レスポンスのパース
-                result = json.loads(response.choices[0].message.content)
-
-                # 結果の検証
-                if not isinstance(result, dict):
-                    raise ValueError("API response is not a dictionary")
-
-                required_keys = ["imageType", "content", "features"]
-                missing_keys = [
-                    key for key in required_keys if key not in result
-                ]
-                if missing_keys:
-                    raise ValueError(
-                        f"Missing required keys in API response: {missing_keys}"
-                    )
-
-                return result
-
-            except json.JSONDecodeError as json_error:
-                print(f"\nJSON Decode Error: {str(json_error)}")
-                print(
-                    f"Raw response content: {response.choices[0].message.content}"
-                )
-                raise
+    @staticmethod
+    def _parse_image_analysis(content: str) -> Dict[str, Any]:
+        """画像分析の応答をパースし、必要な項目がそろっているか検証する"""
+        try:
+            result = orjson.loads(content)
+        except orjson.JSONDecodeError as json_error:
+            print(f"\nJSON Decode Error: {str(json_error)}")
+            print(f"Raw response content: {content}")
+            raise
+
+        # 結果の検証
+        if not isinstance(result, dict):
+            raise ValueError("API response is not a dictionary")
+
+        required_keys = ["imageType", "content", "features"]
+        missing_keys = [key for key in required_keys if key not in result]
+        if missing_keys:
+            raise ValueError(
+                f"Missing required keys in API response: {missing_keys}")
 
-            except Exception as api_error:
-                print(f"\nAPI Error: {str(api_error)}")
-                print(f"Error type: {type(api_error)}")
-                if hasattr(api_error, 'response'):
-                    print(f"API error response: {api_error.response}")
-                raise
+        return result
 
+    @staticmethod
+    def _image_analysis_failed(error: Exception) -> Dict[str, Any]:
+        """画像分析に失敗した場合の結果を返す"""
+        print(f"\nError in analyze_image_with_gpt4o: {str(error)}")
+        print(f"Error type: {type(error)}")
+        print(f"Stack trace:\n{traceback.format_exc()}")
+
+        return {
+            "imageType": "unknown",
+            "content": f"画像分析に失敗しました: {str(error)}",
+            "features": []
+        }
+
+    def analyze_image_with_gpt4o(self,
+                                 base64_image: str,
+                                 detail: str = "low") -> Dict[str, Any]:
+        """
+        GPT-4o APIを使用して画像を分析
+
+        Args:
+            base64_image: base64エンコードされた画像
+            detail: 画像入力の解像度（"low"は512px四方・固定トークン数、
+                    グラフの数値など細部を読み取る必要がある場合は"high"）
+        """
+        try:
+            # APIリクエストのデバッグ情報
+            print("\nSending request to gpt-4o API...")
+            print(f"Image data length: {len(base64_image)}")
+
+            content = self._chat_completion(
+                **self._image_request(base64_image, detail))
+
+            # APIレスポンスのデバッグ情報
+            print("\ngpt-4o API Response:")
+            print(f"Response content: {content}")
+
+            return self._parse_image_analysis(content)
         except Exception as e:
-            print(f"\nError in analyze_image_with_gpt4o: {str(e)}")
-            print(f"Error type: {type(e)}")
-            print(f"Stack trace:\n{traceback.format_exc()}")
-
-            return {
-                "imageType": "unknown",
-                "content": f"画像分析に失敗しました: {str(e)}",
-                "features": []
-            }
+            return self._image_analysis_failed(e)
+
+    async def analyze_image_with_gpt4o_async(
+            self, base64_image: str, detail: str = "low") -> Dict[str, Any]:
+        """analyze_image_with_gpt4oの非同期版"""
+        try:
+            content = await self._chat_completion_async(
+                **self._image_request(base64_image, detail))
+            return self._parse_image_analysis(content)
+        except Exception as e:
+            return self._image_analysis_failed(e)
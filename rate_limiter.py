@@ -0,0 +1,158 @@
+"""
+Rate Limiter Module
+OpenAI APIのレート制限（RPM/TPM）に合わせてリクエストの発行を調整するモジュール
+
+主な機能:
+- 1分あたりのリクエスト数・トークン数の上限管理（リーキーバケット方式）
+- 容量が回復するまでの待機（同期・非同期の両方に対応）
+- APIの応答から得たアカウントの上限への調整
+- リクエスト内容からの消費トークン数の概算（tiktokenによるトークン数）
+"""
+
+import asyncio
+import functools
+import threading
+import time
+from typing import Any, Dict
+
+import tiktoken
+
+# 画像入力1枚あたりの概算トークン数（detail: low 相当）
+_IMAGE_TOKENS = 85
+# メッセージ1件あたりの書式（role等）のトークン数
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@functools.lru_cache(maxsize=1)
+def _get_encoding():
+    """gpt-4o系のトークナイザーを取得（取得できない環境ではNone）"""
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        # 初回はエンコーディング定義のダウンロードが必要なため、オフラインでは失敗する
+        return None
+
+
+@functools.lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """
+    テキストのトークン数を数える（固定のsystemプロンプト等は結果を再利用する）
+
+    トークナイザーを利用できない場合は、ASCIIは4文字≒1トークン、
+    日本語などの非ASCII文字は1文字≒1トークンとして概算する。
+    """
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return ascii_chars // 4 + (len(text) - ascii_chars)
+
+
+def estimate_tokens(request: Dict[str, Any]) -> int:
+    """
+    Chat Completionsリクエストが消費するトークン数を概算する
+
+    プロンプトのトークン数に、応答分として max_tokens を加える。
+
+    Args:
+        request: chat.completions.create に渡すパラメータ
+
+    Returns:
+        int: 概算トークン数
+    """
+    tokens = 0
+    for message in request.get("messages", []):
+        tokens += _MESSAGE_OVERHEAD_TOKENS
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += count_tokens(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    tokens += count_tokens(part.get("text", ""))
+                else:
+                    tokens += _IMAGE_TOKENS
+    return tokens + request.get("max_tokens", 0)
+
+
+class RateLimiter:
+    """
+    1分あたりのリクエスト数・トークン数の上限を超えないよう発行を待機させる
+
+    容量は経過時間に比例して上限まで回復し、リクエストごとに1リクエスト分と
+    概算トークン数分を消費する。スレッド・コルーチンのどちらからも利用できる。
+    """
+
+    def __init__(self, max_requests_per_minute: int,
+                 max_tokens_per_minute: int):
+        self.max_requests_per_minute = max_requests_per_minute
+        self.max_tokens_per_minute = max_tokens_per_minute
+        self.available_request_capacity = float(max_requests_per_minute)
+        self.available_token_capacity = float(max_tokens_per_minute)
+        self._last_update = time.monotonic()
+        self._calibrated = False  # set_limitsで実際の上限に合わせたか
+        self._lock = threading.Lock()
+
+    def set_limits(self, max_requests_per_minute: int,
+                   max_tokens_per_minute: int) -> bool:
+        """
+        上限を更新する（初回は指定値に合わせ、以降は現在より小さい場合のみ下げる）
+
+        Returns:
+            bool: 上限が変わった場合True
+        """
+        with self._lock:
+            if self._calibrated:
+                max_requests_per_minute = min(max_requests_per_minute,
+                                              self.max_requests_per_minute)
+                max_tokens_per_minute = min(max_tokens_per_minute,
+                                            self.max_tokens_per_minute)
+            self._calibrated = True
+            if (max_requests_per_minute == self.max_requests_per_minute
+                    and max_tokens_per_minute == self.max_tokens_per_minute):
+                return False
+            self.max_requests_per_minute = max_requests_per_minute
+            self.max_tokens_per_minute = max_tokens_per_minute
+            self.available_request_capacity = min(
+                self.available_request_capacity, max_requests_per_minute)
+            self.available_token_capacity = min(self.available_token_capacity,
+                                                max_tokens_per_minute)
+            return True
+
+    def _try_acquire(self, tokens: int) -> float:
+        """容量があれば消費して0を、なければ回復までに必要な待機秒数を返す"""
+        # 1件で上限を超えるリクエストは、容量が満杯になった時点で通す
+        tokens = min(tokens, self.max_tokens_per_minute)
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._last_update
+            self._last_update = now
+            self.available_request_capacity = min(
+                self.max_requests_per_minute,
+                self.available_request_capacity +
+                self.max_requests_per_minute * elapsed / 60)
+            self.available_token_capacity = min(
+                self.max_tokens_per_minute, self.available_token_capacity +
+                self.max_tokens_per_minute * elapsed / 60)
+
+            if (self.available_request_capacity >= 1
+                    and self.available_token_capacity >= tokens):
+                self.available_request_capacity -= 1
+                self.available_token_capacity -= tokens
+                return 0.0
+
+            request_wait = ((1 - self.available_request_capacity) * 60 /
+                            self.max_requests_per_minute)
+            token_wait = ((tokens - self.available_token_capacity) * 60 /
+                          self.max_tokens_per_minute)
+            return max(request_wait, token_wait, 0.01)
+
+    async def acquire(self, tokens: int) -> None:
+        """容量が確保できるまで非同期に待機する"""
+        while (wait := self._try_acquire(tokens)) > 0:
+            await asyncio.sleep(wait)
+
+    def acquire_sync(self, tokens: int) -> None:
+        """容量が確保できるまでスレッドをブロックして待機する"""
+        while (wait := self._try_acquire(tokens)) > 0:
+            time.sleep(wait)
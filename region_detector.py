@@ -6,18 +6,74 @@ Excelシート内の有意な領域を検出するためのモジュール
 - 連続したデータ領域の境界検出
 - 結合セルの情報抽出
 - テーブル構造の範囲特定
+- シートのセル領域の候補の収集（複数シートはプロセスを分けて並行に走査できる）
 """
 
-from typing import Tuple, List, Dict, Any
+import io
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Tuple, List, Dict, Any, Optional, Set
+import numpy as np
+from openpyxl import load_workbook
 from openpyxl.utils import get_column_letter
+from cell_processor import CellProcessor, merged_cell_index
 from logger import Logger
 
+
+def sheet_dimensions(sheet) -> Tuple[int, int]:
+    """
+    シートの最終行・最終列の番号を返す
+
+    read_onlyで開いたシートは、ファイルに寸法の記録がないと最終行・最終列がNoneになるため、
+    その場合はシートを走査して求める（記録が誤っている場合は呼び出し側で sheet.reset_dimensions() を行う）。
+    """
+    if sheet.max_row is None or sheet.max_column is None:
+        sheet.calculate_dimension(force=True)
+    return sheet.max_row, sheet.max_column
+
+
+# 下方向の走査で最初に読み込む行数（空行が見つからなければ倍にして読み進める）
+_SCAN_CHUNK_ROWS = 50
+
+
+def _filled_mask(rows: List[Tuple[Any, ...]]) -> np.ndarray:
+    """iter_rows(values_only=True)の行のリストから、値のあるセルをTrueとする2次元の真偽値配列を作る"""
+    if not rows:
+        return np.zeros((0, 0), dtype=bool)
+    return np.not_equal(np.array(rows, dtype=object), None)
+
+
+def _first_empty_run(filled: np.ndarray, run_length: int) -> Optional[int]:
+    """行（列）ごとの値の有無の配列で、空が run_length 個連続する最初の位置を返す（なければNone）"""
+    # 真偽値配列は1要素1バイト（0/1）のため、バイト列の部分一致検索で空の連続を探せる
+    position = filled.tobytes().find(b"\x00" * run_length)
+    return position if position >= 0 else None
+
+
 class RegionDetector:
-    def __init__(self):
-        """RegionDetectorクラスの初期化"""
+    def __init__(self, scan_cols: int = 20, min_empty_rows: int = 1,
+                 min_empty_cols: int = 1, row_limit: int = 1000,
+                 col_limit: int = 50):
+        """
+        RegionDetectorクラスの初期化
+
+        Args:
+            scan_cols: 下方向の走査で値の有無を確認する列数
+            min_empty_rows: 領域の終わりとみなす連続した空行の数
+            min_empty_cols: 領域の終わりとみなす連続した空列の数
+            row_limit: 下方向に走査する最大行数
+            col_limit: 右方向に走査する最大列数（値の有無は検出した行範囲の先頭から同じ行数分で確認する）
+        """
         self.logger = Logger()
+        self.scan_cols = scan_cols
+        self.min_empty_rows = min_empty_rows
+        self.min_empty_cols = min_empty_cols
+        self.row_limit = row_limit
+        self.col_limit = col_limit
 
-    def find_region_boundaries(self, sheet, start_row: int, start_col: int) -> Tuple[int, int]:
+    def find_region_boundaries(self, sheet, start_row: int, start_col: int,
+                               sheet_dims: Optional[Tuple[int, int]] = None) -> Tuple[int, int]:
         """
         指定されたセルから始まる連続したデータ領域の境界を検出
 
@@ -25,61 +81,60 @@ class RegionDetector:
             sheet: 対象のワークシート
             start_row: 開始行番号
             start_col: 開始列番号
+            sheet_dims: シートの最終行・最終列（同じシートの領域を続けて検出する場合は
+                        sheet_dimensions の結果を渡す。省略時はシートから求める）
 
         Returns:
             Tuple[int, int]: 終了行と終了列の番号
         """
         max_row = start_row
         max_col = start_col
-        min_empty_rows = 1
-        min_empty_cols = 1
+        min_empty_rows = self.min_empty_rows
+        min_empty_cols = self.min_empty_cols
+
+        # 最終行・最終列は走査範囲の計算のたびに参照せず、最初に一度だけ求める
+        # （通常のシートでは参照のたびに全セルから計算されるため、呼び出し側で求めた値があれば使う）
+        sheet_max_row, sheet_max_col = sheet_dims or sheet_dimensions(sheet)
 
-        self.logger.debug_boundaries(start_row, start_col, sheet.max_row, sheet.max_column)
+        self.logger.debug_boundaries(start_row, start_col, sheet_max_row, sheet_max_col)
         self.logger.info(f"Starting boundary detection from cell ({start_row}, {start_col})")
 
         # Scan downwards
-        empty_row_count = 0
-        for row in range(start_row, min(sheet.max_row + 1, start_row + 1000)):
-            row_empty = True
-            for col in range(start_col, min(start_col + 20, sheet.max_column + 1)):
-                if sheet.cell(row=row, column=col).value is not None:
-                    row_empty = False
-                    break
-
-            if row_empty:
-                empty_row_count += 1
-                if empty_row_count >= min_empty_rows:
-                    break
-            else:
-                empty_row_count = 0
-                max_row = row
+        # 行単位の値をまとめて読み込み、値の有無の配列から連続する空行を探す
+        # 領域の多くは短いため、全体（最大row_limit行）は一度に読まず、空行が見つかるまで読み進める
+        rows = sheet.iter_rows(min_row=start_row,
+                               max_row=min(sheet_max_row, start_row + self.row_limit - 1),
+                               min_col=start_col,
+                               max_col=min(start_col + self.scan_cols - 1, sheet_max_col),
+                               values_only=True)
+        row_filled = np.zeros(0, dtype=bool)
+        chunk_rows = _SCAN_CHUNK_ROWS
+        while True:
+            chunk = list(itertools.islice(rows, chunk_rows))
+            row_filled = np.concatenate([row_filled, _filled_mask(chunk).any(axis=1)])
+            empty_start = _first_empty_run(row_filled, min_empty_rows)
+            if empty_start is not None or len(chunk) < chunk_rows:
+                break
+            chunk_rows *= 2
+        filled_rows = np.flatnonzero(row_filled[:empty_start])
+        if filled_rows.size:
+            max_row = start_row + int(filled_rows[-1])
 
         # Scan rightwards
-        empty_col_count = 0
-        for col in range(start_col, min(sheet.max_column + 1, start_col + 50)):
-            col_empty = True
-            for row in range(start_row, min(max_row + 1, start_row + 50)):
-                if sheet.cell(row=row, column=col).value is not None:
-                    col_empty = False
-                    break
-
-            if col_empty:
-                empty_col_count += 1
-                if empty_col_count >= min_empty_cols:
-                    break
-            else:
-                empty_col_count = 0
-                max_col = col
+        # 検出した行範囲（最大col_limit行）を一度に読み込み、列ごとの値の有無から連続する空列を探す
+        block = list(sheet.iter_rows(min_row=start_row,
+                                     max_row=min(max_row, start_row + self.col_limit - 1),
+                                     min_col=start_col,
+                                     max_col=min(sheet_max_col, start_col + self.col_limit - 1),
+                                     values_only=True))
+        col_filled = _filled_mask(block).any(axis=0)
+        empty_start = _first_empty_run(col_filled, min_empty_cols)
+        filled_cols = np.flatnonzero(col_filled[:empty_start])
+        if filled_cols.size:
+            max_col = start_col + int(filled_cols[-1])
 
         # Maintain minimum boundaries and ensure single cells are not skipped
-        if sheet.cell(row=start_row, column=start_col).value is not None:
-            max_row = max(max_row, start_row)
-            max_col = max(max_col, start_col)
-            return max_row, max_col
-        else:
-            max_row = max(max_row, start_row)
-            max_col = max(max_col, start_col)
-            return max_row, max_col
+        return max(max_row, start_row), max(max_col, start_col)
 
     def get_merged_cells_info(self, sheet, start_row: int, start_col: int, max_row: int, max_col: int) -> List[Dict[str, Any]]:
         """
@@ -95,12 +150,128 @@ class RegionDetector:
         Returns:
             List[Dict[str, Any]]: 結合セルの情報リスト (各要素は辞書で、'range'と'value'を含む)
         """
-        merged_cells_info = []
-        for merged_range in sheet.merged_cells.ranges:
-            if (merged_range.min_row >= start_row and merged_range.max_row <= max_row and
-                merged_range.min_col >= start_col and merged_range.max_col <= max_col):
-                merged_cells_info.append({
-                    "range": str(merged_range),
-                    "value": sheet.cell(row=merged_range.min_row, column=merged_range.min_col).value
+        return [{
+            "range": str(merged_range),
+            "value": sheet.cell(row=merged_range.min_row, column=merged_range.min_col).value
+        } for merged_range in merged_cell_index(sheet).ranges_within(start_row, start_col, max_row, max_col)]
+
+
+def scan_cell_regions(sheet, processed_cells: Set[Tuple[int, int]],
+                      region_detector: RegionDetector,
+                      cell_processor: CellProcessor,
+                      logger: Logger) -> List[Dict[str, Any]]:
+    """
+    シートのセルを走査し、LLMで分析するセル領域の候補を返す
+
+    Args:
+        sheet: 対象のワークシート
+        processed_cells: 走査対象から除く (行, 列)（描画が占めるセル。検出した領域のセルも追加される）
+        region_detector: 領域の境界・結合セルの検出に使うRegionDetector
+        cell_processor: 領域のセル情報の抽出に使うCellProcessor
+        logger: ログ出力用のLoggerインスタンス
+
+    Returns:
+        List[Dict[str, Any]]: 領域の位置・セル情報・結合セルの情報を含む候補のリスト
+    """
+    candidates = []
+    # 最終行・最終列はプロパティの参照のたびに全セルから計算されるため、最初に一度だけ求める
+    sheet_max_row, sheet_max_col = sheet_dimensions(sheet)
+    logger.info(
+        f"Sheet dimensions: {sheet_max_row} rows x {sheet_max_col} columns")
+
+    get_cell = sheet.cell
+    for row in range(1, min(sheet_max_row + 1, 500)):
+        for col in range(1, min(sheet_max_col + 1, 50)):
+            try:
+                if (row, col) in processed_cells:
+                    continue
+
+                cell = get_cell(row=row, column=col)
+                if cell.value is None:
+                    continue
+
+                # 区切り文字のみのセルはスキップ
+                if isinstance(cell.value, str) and len(
+                        cell.value.strip()) == 1 and cell.value.strip() in '-_=':
+                    continue
+
+                max_row, max_col = region_detector.find_region_boundaries(
+                    sheet, row, col, (sheet_max_row, sheet_max_col))
+                logger.info(
+                    f"max_row:{max_row}, max_col:{get_column_letter(max_col)}")
+                cells_data = cell_processor.extract_region_cells(
+                    sheet, row, col, max_row, max_col)
+                if not cells_data:  # 空のデータの場合はスキップ
+                    continue
+
+                merged_cells = region_detector.get_merged_cells_info(
+                    sheet, row, col, max_row, max_col)
+
+                # 処理済みのセルを記録
+                processed_cells.update((r, c)
+                                       for r in range(row, max_row + 1)
+                                       for c in range(col, max_col + 1))
+
+                # LLMによる分析は後でまとめて並行実行する
+                candidates.append({
+                    "row": row,
+                    "col": col,
+                    "max_row": max_row,
+                    "max_col": max_col,
+                    "cells": cells_data,
+                    "mergedCells": merged_cells
                 })
-        return merged_cells_info
\ No newline at end of file
+
+            except Exception as e:
+                logger.error(
+                    f"Error processing cell at row {row}, col {col}: {str(e)}")
+                continue
+
+    return candidates
+
+
+# 並列走査のワーカープロセスで読み込んだブック（プロセスごとに一度だけ読み込む）
+_scan_workbook = None
+
+
+def _init_scan_worker(file_bytes: bytes) -> None:
+    """並列走査のワーカープロセスの初期化（ブックを読み込む）"""
+    global _scan_workbook
+    _scan_workbook = load_workbook(io.BytesIO(file_bytes), data_only=True)
+
+
+def _scan_sheet_in_worker(
+        sheet_name: str,
+        processed_cells: Set[Tuple[int, int]]) -> List[Dict[str, Any]]:
+    """ワーカープロセスで1シート分のセル領域の候補を収集する"""
+    logger = Logger()
+    return scan_cell_regions(_scan_workbook[sheet_name], processed_cells,
+                             RegionDetector(), CellProcessor(logger), logger)
+
+
+def scan_sheets_parallel(file_bytes: bytes, sheet_names: List[str],
+                         processed_cells: List[Set[Tuple[int, int]]],
+                         processes: int) -> List[List[Dict[str, Any]]]:
+    """
+    複数シートのセル領域の候補を、ワーカープロセスで並行に収集する
+
+    openpyxlのオブジェクトはプロセス間で受け渡さず、各ワーカーがファイルの内容からブックを読み込む。
+
+    Args:
+        file_bytes: Excelファイルの内容
+        sheet_names: 走査するシート名のリスト
+        processed_cells: シートごとの、走査対象から除く (行, 列)
+        processes: ワーカープロセス数の上限
+
+    Returns:
+        List[List[Dict[str, Any]]]: シートごとのセル領域の候補（scan_cell_regionsの結果）
+    """
+    if not sheet_names:
+        return []
+    # 呼び出し側ではイベントループ等のスレッドが動作しているため、forkではなくspawnでプロセスを起動する
+    with ProcessPoolExecutor(max_workers=min(processes, len(sheet_names)),
+                             mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_scan_worker,
+                             initargs=(file_bytes, )) as executor:
+        return list(
+            executor.map(_scan_sheet_in_worker, sheet_names, processed_cells))
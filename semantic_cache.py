@@ -0,0 +1,102 @@
+"""
+Semantic Cache Module
+プロンプトの埋め込みベクトルが近い過去の応答を再利用するキャッシュ
+
+主な機能:
+- 正規化したベクトルの内積（コサイン類似度）による最近傍検索
+- 類似度がしきい値以上の過去の応答の返却
+- 同時に問い合わせる中で互いに近いプロンプトのまとめ上げ
+- ベクトルと応答のディスクへの保存・読み込み
+"""
+
+import threading
+from typing import List, Union
+
+import diskcache
+import numpy as np
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """各行をL2ノルム1に正規化する（内積がコサイン類似度になる）"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class SemanticCache:
+    """
+    埋め込みベクトルと応答の組を保持し、近いプロンプトへの応答を返す
+
+    件数は1ブック〜数十ブック分の領域数（数千件程度）を想定し、全件との内積で検索する。
+    内容はdiskcacheの1エントリにまとめて保存する。スレッド・コルーチンのどちらからも利用できる。
+    """
+
+    def __init__(self,
+                 store: diskcache.Cache,
+                 namespace: str,
+                 threshold: float = 0.95,
+                 ttl: Union[int, None] = None):
+        """
+        Args:
+            store: 保存先のdiskcache
+            namespace: 保存キーの識別子（埋め込みモデルと応答を生成したモデルを含める）
+            threshold: 過去の応答を再利用するコサイン類似度の下限
+            ttl: 最後の追加から保存内容を破棄するまでの秒数（Noneなら期限なし）
+        """
+        self.threshold = threshold
+        self.ttl = ttl
+        self._store = store
+        self._key = f"semantic:{namespace}"
+        self._lock = threading.Lock()
+        vectors, responses = store.get(self._key, (None, []))
+        self._vectors = vectors
+        self._responses: List[str] = list(responses)
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+    def lookup(self, vectors: np.ndarray) -> List[Union[str, None]]:
+        """各ベクトルについて、類似度がしきい値以上の過去の応答（なければNone）を返す"""
+        with self._lock:
+            if self._vectors is None:
+                return [None] * len(vectors)
+            similarities = _normalize(vectors) @ self._vectors.T
+            best = similarities.argmax(axis=1)
+            return [
+                self._responses[j] if similarities[i, j] >= self.threshold
+                else None for i, j in enumerate(best)
+            ]
+
+    def group(self, vectors: np.ndarray) -> List[int]:
+        """
+        互いに近いベクトルをまとめ、各ベクトルの代表（最初に現れた近いベクトル）の位置を返す
+
+        代表の応答を他のベクトルにも使うことで、同時に問い合わせる近いプロンプトを1回にまとめる。
+        """
+        if len(vectors) == 0:
+            return []
+        vectors = _normalize(vectors)
+        similarities = vectors @ vectors.T
+        leaders: List[int] = []  # 代表となったベクトルの位置
+        result = []
+        for i in range(len(vectors)):
+            leader = next(
+                (j for j in leaders if similarities[i, j] >= self.threshold),
+                None)
+            if leader is None:
+                leaders.append(i)
+                leader = i
+            result.append(leader)
+        return result
+
+    def add(self, vectors: np.ndarray, responses: List[str]) -> None:
+        """ベクトルと応答の組を追加し、ディスクに保存する"""
+        if len(responses) == 0:
+            return
+        with self._lock:
+            vectors = _normalize(vectors)
+            self._vectors = (vectors if self._vectors is None else
+                             np.vstack([self._vectors, vectors]))
+            self._responses.extend(responses)
+            self._store.set(self._key, (self._vectors, self._responses),
+                            expire=self.ttl)
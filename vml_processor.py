@@ -9,10 +9,26 @@ VML (Vector Markup Language) 形式のExcelコントロールを処理するモ
 - コントロールの位置情報の抽出
 """
 
+import io
+import re
 from logger import Logger
 from openpyxl.utils import get_column_letter
 import xml.etree.ElementTree as ET
 
+# 名前空間を展開した要素名（呼び出しごとに名前空間の対応表から組み立てない）
+_VML_NS = '{urn:schemas-microsoft-com:vml}'
+_EXCEL_NS = '{urn:schemas-microsoft-com:office:excel}'
+_V_SHAPE = _VML_NS + 'shape'
+_V_TEXTBOX = _VML_NS + 'textbox'
+_X_CLIENTDATA = _EXCEL_NS + 'ClientData'
+_X_CHECKED = _EXCEL_NS + 'Checked'
+_X_ANCHOR = _EXCEL_NS + 'Anchor'
+_X_FIRSTBUTTON = _EXCEL_NS + 'FirstButton'
+
+# x:Anchorの値（左列, 左オフセット, 上行, 上オフセット, 右列, 右オフセット, 下行, 下オフセット）の各数値
+_ANCHOR_NUMBER = re.compile(r'-?\d+')
+
+
 class VMLProcessor:
     def __init__(self, logger: Logger):
         """
@@ -48,80 +64,118 @@ class VMLProcessor:
             ValueError: 不正なコントロール情報
         """
         controls = []
+        # x:ClientDataを1つも含まないVML（装飾の図形のみ等）にはフォームコントロールがないため、解析せずに終える
+        if 'ClientData' not in vml_content:
+            return controls
         try:
-            namespaces = {
-                'v': 'urn:schemas-microsoft-com:vml',
-                'o': 'urn:schemas-microsoft-com:office:office',
-                'x': 'urn:schemas-microsoft-com:office:excel'
-            }
-
-            root = ET.fromstring(vml_content)
-            control_elements = root.findall('.//{urn:schemas-microsoft-com:vml}shape')
-
-            for element in control_elements:
+            # 全体のツリーを作ってから検索せず、図形の終了タグごとにその子要素だけを1回走査する
+            parents = []  # 解析中の要素の祖先（処理済みの図形を親要素から取り除くため）
+            for event, element in ET.iterparse(io.StringIO(vml_content), events=('start', 'end')):
+                if event == 'start':
+                    parents.append(element)
+                    continue
+                parents.pop()
+                if element.tag != _V_SHAPE:
+                    continue
                 try:
-                    # テキスト内容を取得
-                    textbox = element.find('.//v:textbox', namespaces)
-                    text_content = ""
-                    if textbox is not None:
-                        div = textbox.find('.//div')
-                        if div is not None:
-                            text_content = "".join(div.itertext()).strip()
-
-                    control_type = element.find('.//{urn:schemas-microsoft-com:office:excel}ClientData')
-                    if control_type is not None:
-                        control_type_value = control_type.get('ObjectType')
-
-                        shape_id = element.get('id', '')
-                        try:
-                            numeric_id = shape_id.split('_s')[-1]
-                            numeric_id = int(numeric_id) if numeric_id.isdigit() else None
-
-                        except (ValueError, IndexError) as e:
-                            self.logger.error(f"Error extracting numeric ID from shape_id {shape_id}: {str(e)}")
-                            continue
-
-                        control = {
-                            'id': shape_id,
-                            'numeric_id': str(numeric_id) if numeric_id is not None else None,
-                            'type': 'checkbox' if control_type_value == 'Checkbox' else 'radio',
-                            'checked': False,
-                            'position': '',
-                            'text': text_content
-                        }
-
-                        # チェックボックスの状態
-                        checked = control_type.find('.//{urn:schemas-microsoft-com:office:excel}Checked')
-                        if checked is not None and checked.text:
-                            control['checked'] = checked.text == '1'
-
-                        # アンカー情報の解析（セルの位置）
-                        anchor = control_type.find('.//{urn:schemas-microsoft-com:office:excel}Anchor')
-                        if anchor is not None and anchor.text:
-                            try:
-                                coords = [int(x) for x in anchor.text.split(',')]
-                                from_col = coords[0]
-                                from_row = coords[1]
-                                to_col = coords[2]
-                                to_row = coords[3]
-                                control['position'] = f"{get_column_letter(from_col + 1)}{from_row + 1}:{get_column_letter(to_col + 1)}{to_row + 1}"
-                            except (ValueError, IndexError) as e:
-                                self.logger.error(f"Error processing anchor coordinates: {str(e)}")
-
-                        # ラジオボタンの追加情報
-                        if control_type_value == 'Radio':
-                            first_button = control_type.find('.//{urn:schemas-microsoft-com:office:excel}FirstButton')
-                            if first_button is not None:
-                                control['is_first_button'] = first_button.text == '1'
-
+                    control = self._parse_control_shape(element)
+                    if control is not None:
                         controls.append(control)
-
                 except Exception as control_error:
                     self.logger.error(f"Error processing individual control: {str(control_error)}")
-                    continue
+                finally:
+                    # 処理済みの図形は破棄して親要素からも取り除き、図形の数によらずツリーを小さく保つ
+                    element.clear()
+                    if parents:
+                        parents[-1].remove(element)
 
         except Exception as e:
             self.logger.error(f"Error parsing VML content: {str(e)}")
             self.logger.exception(e)
 
         return controls
+
+    def _parse_control_shape(self, element):
+        """
+        VMLの図形要素1つからフォームコントロール情報を抽出
+
+        Args:
+            element: v:shape要素
+
+        Returns:
+            Dict: コントロール情報（フォームコントロールでない図形はNone）
+        """
+        textbox = None
+        control_type = None
+        for child in element:
+            if child.tag == _V_TEXTBOX:
+                if textbox is None:
+                    textbox = child
+            elif child.tag == _X_CLIENTDATA:
+                if control_type is None:
+                    control_type = child
+        if control_type is None:
+            return None
+
+        # テキスト内容を取得
+        text_content = ""
+        if textbox is not None:
+            div = textbox.find('.//div')
+            if div is not None:
+                text_content = "".join(div.itertext()).strip()
+
+        control_type_value = control_type.get('ObjectType')
+
+        shape_id = element.get('id', '')
+        try:
+            numeric_id = shape_id.split('_s')[-1]
+            numeric_id = int(numeric_id) if numeric_id.isdigit() else None
+
+        except (ValueError, IndexError) as e:
+            self.logger.error(f"Error extracting numeric ID from shape_id {shape_id}: {str(e)}")
+            return None
+
+        control = {
+            'id': shape_id,
+            'numeric_id': str(numeric_id) if numeric_id is not None else None,
+            'type': 'checkbox' if control_type_value == 'Checkbox' else 'radio',
+            'checked': False,
+            'position': '',
+            'text': text_content
+        }
+
+        # ClientDataの子要素（チェック状態・アンカー・グループ先頭）を1回の走査で取り出す
+        checked = anchor = first_button = None
+        for child in control_type:
+            if child.tag == _X_CHECKED:
+                if checked is None:
+                    checked = child
+            elif child.tag == _X_ANCHOR:
+                if anchor is None:
+                    anchor = child
+            elif child.tag == _X_FIRSTBUTTON:
+                if first_button is None:
+                    first_button = child
+
+        # チェックボックスの状態
+        if checked is not None and checked.text:
+            control['checked'] = checked.text == '1'
+
+        # アンカー情報の解析（セルの位置）
+        if anchor is not None and anchor.text:
+            try:
+                # オフセット（ピクセル）を除いた列・行の位置は 0, 2, 4, 6 番目の値
+                coords = _ANCHOR_NUMBER.findall(anchor.text)
+                from_col = int(coords[0])
+                from_row = int(coords[2])
+                to_col = int(coords[4])
+                to_row = int(coords[6])
+                control['position'] = f"{get_column_letter(from_col + 1)}{from_row + 1}:{get_column_letter(to_col + 1)}{to_row + 1}"
+            except (ValueError, IndexError) as e:
+                self.logger.error(f"Error processing anchor coordinates: {str(e)}")
+
+        # ラジオボタンの追加情報
+        if control_type_value == 'Radio' and first_button is not None:
+            control['is_first_button'] = first_button.text == '1'
+
+        return control